@@ -1,9 +1,17 @@
 from flask import Blueprint, request, jsonify,current_app as app
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateMany
 from datetime import datetime
-from pymongo.errors import PyMongoError
+from pymongo.errors import DuplicateKeyError, PyMongoError
 from tokenCheck import token_required
 from db import DB_NAME,MONGO_URI,db
+from bidEngine import empty_bid_fields
+from productResolver import product_resolver
+from productImport import UnsupportedFormat, import_products, iter_rows
+from auctionRegistrations import registration_index
+from auctionClock import auction_clock, deadline_iso, parse_deadline
+from settlement import LeaseLost, claim, release, settle
+from settlementScheduler import settlement_scheduler
+from jobs import enqueue_cascade_delete, job_status
 
 # client = MongoClient(MONGO_URI)
 # db = client[DB_NAME]
@@ -14,6 +22,7 @@ auctions = db["auctions"]
 users=db["users"]
 admins=db["admins"]
 transactions=db["transactions"]
+registrations=db["registrations"]
 
 # Admin routes
 # 1️⃣ Create Auction
@@ -25,13 +34,16 @@ def create_auction(decoded_token):
     for f in ("id","name","product_ids","valid_until"):
         if f not in data:
             return jsonify({"error": f"{f} required"}), 400
+    try:
+        valid_until = parse_deadline(data["valid_until"])
+    except ValueError:
+        return jsonify({"error": "valid_until must be an ISO 8601 datetime"}), 400
 
     auction = {
         "id": data["id"],
         "name": data["name"],
         "product_ids": data["product_ids"],
-        "valid_until": data["valid_until"],
-        "registrations": [],              # new empty list
+        "valid_until": valid_until,
         "created_by": decoded_token["admin_id"],
         "time_created": datetime.utcnow(),
         "settled": False,
@@ -48,7 +60,12 @@ def create_auction(decoded_token):
                 "admin_id": decoded_token["admin_id"]
             }}
         )
+        product_resolver.invalidate()
+        auction_clock.refresh(auction["id"], valid_until)
+        settlement_scheduler.schedule(auction["id"], valid_until)
         return jsonify({"message":"Auction created"}), 201
+    except DuplicateKeyError:
+        return jsonify({"error":"Auction id already exists"}), 400
     except PyMongoError as e:
         app.logger.error(str(e))
         return jsonify({"error":"Failed to create auction"}), 500
@@ -66,13 +83,14 @@ def update_product(decoded_token, product_id):
             return jsonify({"success": False, "message": "No valid fields to update"}), 400
 
         # 2) Ensure product exists
-        prod = products.find_one({"id": product_id})
+        prod = products.find_one({"id": product_id}, {"bids": 0})
         if not prod:
             return jsonify({"success": False, "message": "Product not found"}), 404
 
         # 3) Perform update
         try:
             res = products.update_one({"id": product_id}, {"$set": allowed})
+            product_resolver.invalidate()
             if res.modified_count == 0:
                 return jsonify({"success": False, "message": "No changes made to product"}), 200
             return jsonify({"success": True, "message": "Product updated."}), 200
@@ -97,6 +115,11 @@ def update_auction(decoded_token, auction_id):
         allowed = {k: v for k, v in data.items() if k in ("name", "product_ids", "valid_until")}
         if not allowed:
             return jsonify({"success": False, "message": "No valid fields to update"}), 400
+        if "valid_until" in allowed:
+            try:
+                allowed["valid_until"] = parse_deadline(allowed["valid_until"])
+            except ValueError:
+                return jsonify({"success": False, "message": "valid_until must be an ISO 8601 datetime"}), 400
 
         # 2) Ensure auction exists
         old_auction = auctions.find_one({"id": auction_id})
@@ -108,29 +131,47 @@ def update_auction(decoded_token, auction_id):
             res = auctions.update_one({"id": auction_id}, {"$set": allowed})
             if res.modified_count == 0:
                 return jsonify({"success": False, "message": "No changes made to auction"}), 200
+            auction_clock.forget(auction_id)
+            if "valid_until" in allowed and not old_auction.get("settled", False):
+                settlement_scheduler.schedule(auction_id, allowed["valid_until"])
 
         except PyMongoError as e:
             app.logger.error(f"Database error in update_auction: {e}")
             return jsonify({"success": False, "message": "Failed to update auction"}), 500
 
-        # 4) If product_ids changed, relink products
+        # 4) If product_ids changed, relink only the products that moved
         if "product_ids" in allowed:
-            try:
-                # Unlink all previously linked products
-                products.update_many(
-                    {"auction_id": auction_id},
+            old_ids = set(old_auction.get("product_ids") or [])
+            new_ids = set(allowed["product_ids"])
+            removed, added = list(old_ids - new_ids), list(new_ids - old_ids)
+            ops = []
+            if removed:
+                ops.append(UpdateMany(
+                    {"id": {"$in": removed}, "auction_id": auction_id},
                     {"$set": {"auction_id": None}}
-                )
-                # Link new batch
-                products.update_many(
-                    {"id": {"$in": allowed["product_ids"]}},
-                    {"$set": {"auction_id": auction_id}}
-                )
+                ))
+            if added:
+                ops.append(UpdateMany(
+                    {"id": {"$in": added}},
+                    {"$set": {
+                        "auction_id": auction_id,
+                        "sold_to": None,
+                        "admin_id": decoded_token["admin_id"]
+                    }}
+                ))
+            try:
+                if ops:
+                    products.bulk_write(ops, ordered=True)
+                    product_resolver.invalidate()
 
             except PyMongoError as e:
                 app.logger.error(f"Failed to update product links: {e}")
-                # Revert auction update
-                auctions.update_one({"id": auction_id}, {"$set": old_auction})
+                # Revert only the fields this request changed
+                auctions.update_one(
+                    {"id": auction_id},
+                    {"$set": {k: old_auction.get(k) for k in allowed}}
+                )
+                auction_clock.forget(auction_id)
                 return jsonify({"success": False, "message": "Failed to update product links"}), 500
 
         return jsonify({"success": True, "message": "Auction updated."}), 200
@@ -158,6 +199,7 @@ def delete_auction(decoded_token, auction_id):
                 {"auction_id": auction_id},
                 {"$set": {"auction_id": None}}
             )
+            product_resolver.invalidate()
         except PyMongoError as e:
             app.logger.error(f"Failed to unlink products: {e}")
             return jsonify({"success": False, "message": "Failed to unlink products"}), 500
@@ -165,18 +207,29 @@ def delete_auction(decoded_token, auction_id):
         # 3) Delete the auction
         try:
             auctions.delete_one({"id": auction_id})
+            auction_clock.forget(auction_id)
+            settlement_scheduler.cancel(auction_id)
         except PyMongoError as e:
             app.logger.error(f"Failed to delete auction: {e}")
             return jsonify({"success": False, "message": "Failed to delete auction"}), 500
 
-        # 4) Cleanup bids (optional)
+        # 4) Cleanup bids and registrations in the background
+        registration_index.forget(auction_id)
         try:
-            bids.delete_many({"auction_id": auction_id})
+            job_id = enqueue_cascade_delete(f"auction {auction_id}", [
+                ("bids", {"auction_id": auction_id}),
+                ("registrations", {"auction_id": auction_id})
+            ])
         except PyMongoError as e:
-            app.logger.error(f"Failed to delete related bids: {e}")
+            app.logger.error(f"Failed to queue cleanup of auction {auction_id}: {e}")
+            job_id = None
             # continue — auction deletion succeeded
 
-        return jsonify({"success": True, "message": "Auction deleted and products unlinked."}), 200
+        return jsonify({
+            "success": True,
+            "message": "Auction deleted and products unlinked.",
+            "cleanup_job_id": job_id
+        }), 202
 
     except Exception as e:
         app.logger.error(f"Unexpected error in delete_auction: {e}")
@@ -191,40 +244,60 @@ def delete_product(decoded_token, product_id):
             return jsonify({"success": False, "message": "Missing product_id"}), 400
 
         # 1) Ensure exists
-        prod = products.find_one({"id": product_id})
+        prod = products.find_one({"id": product_id}, {"bids": 0})
         if not prod:
             return jsonify({"success": False, "message": "Product not found"}), 404
 
         # 2) Delete the product
         try:
             products.delete_one({"id": product_id})
+            product_resolver.invalidate()
         except PyMongoError as e:
             app.logger.error(f"Failed to delete product: {e}")
             return jsonify({"success": False, "message": "Failed to delete product"}), 500
 
-        # 3) Remove from auctions' product_ids
+        # 3) Remove from the owning auction's product_ids (products.auction_id is authoritative)
         try:
-            auctions.update_many(
-                {},
-                {"$pull": {"product_ids": product_id}}
-            )
+            if prod.get("auction_id"):
+                auctions.update_one(
+                    {"id": prod["auction_id"]},
+                    {"$pull": {"product_ids": product_id}}
+                )
         except PyMongoError as e:
             app.logger.error(f"Failed to remove product from auctions: {e}")
             # continue — product deletion succeeded
 
-        # 4) Cleanup bids
+        # 4) Cleanup bids in the background
         try:
-            bids.delete_many({"product_id": product_id})
+            job_id = enqueue_cascade_delete(f"product {product_id}", [("bids", {"product_id": product_id})])
         except PyMongoError as e:
-            app.logger.error(f"Failed to delete related bids: {e}")
+            app.logger.error(f"Failed to queue cleanup of product {product_id}: {e}")
+            job_id = None
             # continue
 
-        return jsonify({"success": True, "message": "Product deleted and removed from auctions."}), 200
+        return jsonify({
+            "success": True,
+            "message": "Product deleted and removed from auctions.",
+            "cleanup_job_id": job_id
+        }), 202
 
     except Exception as e:
         app.logger.error(f"Unexpected error in delete_product: {e}")
         return jsonify({"success": False, "message": "An unexpected error occurred"}), 500
 
+
+@admin_bp.route("/admin/jobs/<job_id>", methods=["GET"])
+@token_required
+def get_job(decoded_token, job_id):
+    try:
+        job = job_status(job_id)
+    except PyMongoError as e:
+        app.logger.error(f"Failed to fetch job {job_id}: {e}")
+        return jsonify({"error": "Failed to fetch job"}), 500
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
 @admin_bp.route("/admin/product", methods=["POST"])
 @token_required
 def add_product(decoded_token):
@@ -241,16 +314,40 @@ def add_product(decoded_token):
         "sold_to": None,
         "admin_id": decoded_token["admin_id"],
         "status": "unsold",
-        "bids": []
+        "bids": [],
+        **empty_bid_fields()
     }
     try:
         products.insert_one(prod)
+        product_resolver.invalidate()
         return jsonify({"message":"Product added"}), 201
+    except DuplicateKeyError:
+        return jsonify({"error":"Product id already exists"}), 400
     except PyMongoError as e:
         app.logger.error(str(e))
         return jsonify({"error":"Failed to add product"}), 500
 
 
+@admin_bp.route("/admin/products/import", methods=["POST"])
+@token_required
+def import_products_bulk(decoded_token):
+    # Rows are read straight off the request stream, never buffered whole
+    try:
+        rows = iter_rows(request.stream, request.content_type)
+    except UnsupportedFormat as e:
+        return jsonify({"error": str(e)}), 415
+    try:
+        report = import_products(rows, decoded_token["admin_id"])
+    except PyMongoError as e:
+        app.logger.error(f"Product import failed: {str(e)}")
+        return jsonify({"error": "Failed to import products"}), 500
+    finally:
+        product_resolver.invalidate()
+    if not report["rows"]:
+        return jsonify({"error": "No rows in request body"}), 400
+    return jsonify(report), 200
+
+
 @admin_bp.route("/admin/all_auctions", methods=["GET"])
 def get_all_auctions():
     try:
@@ -260,7 +357,7 @@ def get_all_auctions():
             result.append({
                 "id": a.get("id"),
                 "name": a.get("name"),
-                "valid_until": a.get("valid_until"),
+                "valid_until": deadline_iso(a.get("valid_until")),
                 "product_ids": a.get("product_ids", [])
             })
         return jsonify({
@@ -276,7 +373,7 @@ def get_all_auctions():
 @admin_bp.route("/admin/auction_products/<auction_id>", methods=["GET"])
 def get_products_by_auction(auction_id):
     try:
-        matching_products = list(products.find({"auction_id": auction_id}))
+        matching_products = list(products.find({"auction_id": auction_id}, {"bids": 0}))
         result = []
         for p in matching_products:
             result.append({
@@ -304,7 +401,7 @@ def list_unassigned_products(decoded_token):
         "admin_id": decoded_token["admin_id"],
         "auction_id": None,
         "status": "unsold"
-    })
+    }, {"id": 1, "name": 1, "description": 1})
     return jsonify([{
         "id": p["id"], "name": p["name"], "description": p["description"]
     } for p in prods]), 200
@@ -313,7 +410,7 @@ def list_unassigned_products(decoded_token):
 @token_required
 def get_my_products( decoded_token,auction_id):
     # ensure auction belongs to admin?
-    prods = products.find({"auction_id": auction_id})
+    prods = products.find({"auction_id": auction_id}, {"id": 1, "name": 1, "status": 1})
     return jsonify([{"id":p["id"],"name":p["name"],"status":p["status"]} for p in prods]), 200
 
 @admin_bp.route("/admin/auctions/my", methods=["GET"])
@@ -321,14 +418,12 @@ def get_my_products( decoded_token,auction_id):
 def get_my_auctions(decoded_token):
     my = auctions.find({"created_by": decoded_token["admin_id"]})
     return jsonify([{
-        "id": a["id"], "name": a["name"], "valid_until": a["valid_until"]
+        "id": a["id"], "name": a["name"], "valid_until": deadline_iso(a["valid_until"])
     } for a in my]), 200
 
 @admin_bp.route("/admin/auction/<auction_id>/settle", methods=["POST"])
 @token_required
 def settle_auction(decoded_token, auction_id):
-    from datetime import datetime
-
     # 1️⃣ Fetch the auction
     auction = auctions.find_one({"id": auction_id, "created_by": decoded_token["admin_id"]})
     if not auction:
@@ -344,7 +439,7 @@ def settle_auction(decoded_token, auction_id):
 
     # 4️⃣ Check if auction is expired
     try:
-        auction_end_time = datetime.fromisoformat(auction["valid_until"])
+        auction_end_time = parse_deadline(auction["valid_until"])
     except Exception:
         return jsonify({"error": "Invalid auction end time format"}), 500
 
@@ -352,50 +447,26 @@ def settle_auction(decoded_token, auction_id):
     if now < auction_end_time:
         return jsonify({"error": "Auction is still active"}), 400
 
-    # 5️⃣ For each product in this auction, ensure it exists
-    missing_products = []
-    settled_products = []
-
-    for product_id in auction["product_ids"]:
-        product = products.find_one({"id": product_id})
-        if not product:
-            missing_products.append(product_id)
-            continue
-
-        # 6️⃣ Find highest bid
-        highest_bid = bids.find_one(
-            {"product_id": product_id},
-            sort=[("amount", -1)]
-        )
-
-        if highest_bid:
-            update_result = products.update_one(
-                {"id": product_id},
-                {"$set": {
-                    "status": "sold",
-                    "sold_to": highest_bid["user_id"]
-                }}
-            )
-            settled_products.append({"product_id": product_id, "status": "sold", "sold_to": highest_bid["user_id"]})
-        else:
-            update_result = products.update_one(
-                {"id": product_id},
-                {"$set": {
-                    "status": "unsold",
-                    "sold_to": None
-                }}
-            )
-            settled_products.append({"product_id": product_id, "status": "unsold", "sold_to": None})
+    # 5️⃣ Take the settlement lease so a background worker can't settle it too
+    auction = claim(auction_id)
+    if not auction:
+        return jsonify({"error": "Auction is already being settled"}), 409
+    owner = auction["settle_lease_owner"]
 
-    # 7️⃣ Mark auction as settled
-    auctions.update_one(
-        {"id": auction_id},
-        {"$set": {"settled": True, "settled_at": datetime.utcnow()}}
-    )
+    # 6️⃣ Find the winners of every product in one pass and apply them in bulk
+    try:
+        report = settle(auction, owner)
+    except LeaseLost:
+        return jsonify({"error": "Auction is already being settled"}), 409
+    except Exception:
+        release(auction_id, owner)
+        raise
+    settlement_scheduler.cancel(auction_id)
 
-    # 8️⃣ Return detailed result
+    # 7️⃣ Return detailed result
     return jsonify({
         "message": "Auction settled successfully",
-        "settled_products": settled_products,
-        "missing_products": missing_products
+        "settled_products": report["settled_products"],
+        "missing_products": report["missing_products"],
+        "refunds": report["refunds"]
     }), 200
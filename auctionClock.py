@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+from cache import TTLCache
+from db import db
+
+auctions = db["auctions"]
+
+
+def parse_deadline(value):
+    """valid_until as a naive UTC datetime. Raises ValueError for bad values."""
+    if isinstance(value, datetime):
+        deadline = value
+    elif isinstance(value, str):
+        deadline = datetime.fromisoformat(value)
+    else:
+        raise ValueError(f"Unsupported valid_until value: {value!r}")
+    if deadline.tzinfo is not None:
+        deadline = deadline.astimezone(timezone.utc).replace(tzinfo=None)
+    return deadline
+
+
+def deadline_iso(value):
+    """ISO string for API responses, whichever way valid_until is stored."""
+    try:
+        return parse_deadline(value).isoformat()
+    except ValueError:
+        return value
+
+
+def live_auctions_query(now=None):
+    """
+    Auctions that haven't ended. valid_until is a native datetime, but
+    documents not yet migrated still hold ISO strings; Mongo only compares
+    values of the same BSON type, so each branch is its own index range.
+    """
+    now = now or datetime.utcnow()
+    return {"$or": [
+        {"valid_until": {"$gt": now}},
+        {"valid_until": {"$gt": now.isoformat()}}
+    ]}
+
+
+def ended_auctions_query(now=None):
+    """Counterpart of live_auctions_query."""
+    now = now or datetime.utcnow()
+    return {"$or": [
+        {"valid_until": {"$lte": now}},
+        {"valid_until": {"$lte": now.isoformat()}}
+    ]}
+
+
+def seconds_left(deadline, now=None):
+    now = now or datetime.utcnow()
+    return max(int((deadline - now).total_seconds()), 0)
+
+
+class AuctionClock:
+    """
+    Pre-parsed auction deadlines keyed by auction id. Product keys reach it
+    through ProductResolver, which already caches each product's auction_id.
+
+    Admin writes refresh entries in this worker; the TTL bounds how long
+    other workers may serve an old deadline. An expiry is always confirmed
+    against Mongo before anyone acts on it, so an extended auction is never
+    closed early because of a stale entry.
+    """
+
+    def __init__(self, maxsize=4096, ttl=10.0):
+        self._deadlines = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _load(self, auction_id):
+        auction = auctions.find_one({"id": auction_id}, {"valid_until": 1})
+        if not auction or "valid_until" not in auction:
+            return None
+        deadline = parse_deadline(auction["valid_until"])
+        self._deadlines.set(auction_id, deadline)
+        return deadline
+
+    def deadline(self, auction_id):
+        """None if the auction doesn't exist or has no end time."""
+        if auction_id is None:
+            return None
+        deadline = self._deadlines.get(auction_id)
+        if deadline is None:
+            deadline = self._load(auction_id)
+        return deadline
+
+    def has_ended(self, auction_id, now=None):
+        now = now or datetime.utcnow()
+        deadline = self.deadline(auction_id)
+        if deadline is not None and now < deadline:
+            return False
+        deadline = self._load(auction_id)
+        return deadline is None or now >= deadline
+
+    def refresh(self, auction_id, valid_until):
+        self._deadlines.set(auction_id, parse_deadline(valid_until))
+
+    def forget(self, auction_id):
+        self._deadlines.pop(auction_id)
+
+
+auction_clock = AuctionClock()
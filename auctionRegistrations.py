@@ -0,0 +1,61 @@
+from datetime import datetime
+from pymongo.errors import DuplicateKeyError
+from cache import TTLCache
+from db import db
+
+registrations = db["registrations"]
+
+
+class RegistrationIndex:
+    """
+    Per-auction set of registered user ids, loaded once from the
+    `registrations` collection so the bid path checks membership in O(1).
+
+    A miss falls back to an indexed point lookup before rejecting, since the
+    user may have registered through another gunicorn worker.
+    """
+
+    def __init__(self, maxsize=256, ttl=60.0):
+        self._members = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _load(self, auction_id):
+        members = self._members.get(auction_id)
+        if members is None:
+            members = {
+                r["user_id"] for r in registrations.find(
+                    {"auction_id": auction_id}, {"_id": 0, "user_id": 1}
+                )
+            }
+            self._members.set(auction_id, members)
+        return members
+
+    def is_registered(self, auction_id, user_id):
+        members = self._load(auction_id)
+        if user_id in members:
+            return True
+        if registrations.find_one({"auction_id": auction_id, "user_id": user_id}, {"_id": 1}):
+            members.add(user_id)
+            return True
+        return False
+
+    def register(self, auction_id, user_id):
+        """Returns False if the user was already registered."""
+        try:
+            registrations.insert_one({
+                "auction_id": auction_id,
+                "user_id": user_id,
+                "registered_at": datetime.utcnow()
+            })
+            created = True
+        except DuplicateKeyError:
+            created = False
+        members = self._members.get(auction_id)
+        if members is not None:
+            members.add(user_id)
+        return created
+
+    def forget(self, auction_id):
+        self._members.pop(auction_id)
+
+
+registration_index = RegistrationIndex()
@@ -0,0 +1,81 @@
+from datetime import datetime
+from cache import TTLCache
+from db import db
+from auctionClock import parse_deadline
+
+auctions = db["auctions"]
+
+# Listeners arriving within this window share one aggregation.
+SNAPSHOT_TTL = 2.0
+
+snapshot_cache = TTLCache(maxsize=512, ttl=SNAPSHOT_TTL)
+
+
+def snapshot_pipeline(auction_id):
+    """Auction metadata, unsold products and per-product top bid/bid count in one pass."""
+    return [
+        {"$match": {"id": auction_id}},
+        {"$project": {"_id": 0, "id": 1, "name": 1, "valid_until": 1, "settled": 1}},
+        {"$lookup": {
+            "from": "products",
+            "localField": "id",
+            "foreignField": "auction_id",
+            "pipeline": [
+                {"$match": {"status": "unsold"}},
+                {"$project": {"_id": 0, "id": 1, "name": 1}},
+                {"$lookup": {
+                    "from": "bids",
+                    "localField": "id",
+                    "foreignField": "product_id",
+                    "pipeline": [
+                        {"$sort": {"amount": -1}},
+                        {"$group": {
+                            "_id": None,
+                            "bid_count": {"$sum": 1},
+                            "top_amount": {"$first": "$amount"},
+                            "top_bidder": {"$first": "$user_id"}
+                        }}
+                    ],
+                    "as": "bid_stats"
+                }}
+            ],
+            "as": "products"
+        }}
+    ]
+
+
+def _load(auction_id):
+    rows = list(auctions.aggregate(snapshot_pipeline(auction_id)))
+    if not rows:
+        return None
+    auction = rows[0]
+    products = []
+    for p in auction.get("products", []):
+        stats = p["bid_stats"][0] if p.get("bid_stats") else {}
+        products.append({
+            "product_id": p.get("id"),
+            "product_name": p.get("name"),
+            "highest_bid": stats.get("top_amount", 0),
+            "highest_bidder": stats.get("top_bidder"),
+            "bid_count": stats.get("bid_count", 0)
+        })
+    try:
+        deadline = parse_deadline(auction.get("valid_until"))
+    except ValueError:
+        deadline = None
+    return {
+        "auction": {
+            "id": auction["id"],
+            "name": auction.get("name"),
+            "valid_until": deadline.isoformat() if deadline else None,
+            "settled": auction.get("settled", False)
+        },
+        "deadline": deadline,
+        "products": products,
+        "generated_at": datetime.utcnow().isoformat()
+    }
+
+
+def auction_snapshot(auction_id):
+    """Cached snapshot; None if the auction doesn't exist."""
+    return snapshot_cache.get_or_set(auction_id, lambda: _load(auction_id))
@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from db import db
+from auctionClock import auction_clock, seconds_left
+
+products = db["products"]
+
+log = logging.getLogger(__name__)
+
+TICK_SECONDS = 1.0
+SUBSCRIBER_BACKLOG = 100
+
+
+def _default_max_subscribers():
+    threads = os.getenv("GUNICORN_THREADS")
+    if threads is None:
+        return 100  # development server, one thread per request
+    # An API worker keeps at least half of its threads for bids, so a sync
+    # worker serves no streams: they belong on the stream server.
+    return int(threads) // 2
+
+
+MAX_SUBSCRIBERS = int(os.getenv("MAX_STREAMS_PER_WORKER", str(_default_max_subscribers())))
+
+
+class StreamsFull(Exception):
+    pass
+
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class AuctionStream:
+    """
+    Per-auction fan-out of live bid events to Server-Sent Events subscribers.
+
+    The bid path publishes new bids as they are accepted. While an auction
+    has subscribers in this worker, one pump thread ticks the countdown and
+    re-reads the auction's highest bids once per tick, which also picks up
+    bids accepted by other workers and is the only source of bids on the
+    stream server. Watchers therefore cost one query per auction per tick,
+    however many of them there are.
+    """
+
+    def __init__(self, tick=TICK_SECONDS, backlog=SUBSCRIBER_BACKLOG, max_subscribers=MAX_SUBSCRIBERS):
+        self.tick = tick
+        self.backlog = backlog
+        self.max_subscribers = max_subscribers
+        self._count = 0
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._highest = {}
+        self._pumps = {}
+
+    def subscribe(self, auction_id):
+        """Raises StreamsFull when this worker already serves max_subscribers watchers."""
+        q = queue.Queue(maxsize=self.backlog)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise StreamsFull()
+            self._count += 1
+            self._subscribers.setdefault(auction_id, set()).add(q)
+            pump = self._pumps.get(auction_id)
+            if pump is None or not pump.is_alive():
+                pump = threading.Thread(target=self._pump, args=(auction_id,), name=f"stream-{auction_id}", daemon=True)
+                self._pumps[auction_id] = pump
+                pump.start()
+        return q
+
+    def unsubscribe(self, auction_id, q):
+        with self._lock:
+            subs = self._subscribers.get(auction_id)
+            if subs is not None and q in subs:
+                subs.discard(q)
+                self._count -= 1
+                if not subs:
+                    del self._subscribers[auction_id]
+
+    def publish(self, auction_id, event, data):
+        with self._lock:
+            subs = list(self._subscribers.get(auction_id, ()))
+        for q in subs:
+            try:
+                q.put_nowait((event, data))
+            except queue.Full:
+                # Slow consumer: drop the event rather than block the bid path.
+                pass
+
+    def bid_accepted(self, auction_id, product, amount, username, timestamp):
+        """Called by place_bid once a bid has been claimed."""
+        if auction_id not in self._subscribers:
+            return
+        data = {"product_id": product.get("id"), "product_name": product.get("name"),
+                "amount": amount, "user_id": username, "timestamp": timestamp.isoformat()}
+        self.publish(auction_id, "new_bid", data)
+        self._highest.setdefault(auction_id, {})[product.get("id")] = (amount, username)
+        self.publish(auction_id, "highest_bid", {k: data[k] for k in ("product_id", "product_name", "amount", "user_id")})
+
+    def snapshot(self, auction_id):
+        prods = products.find(
+            {"auction_id": auction_id, "status": "unsold"},
+            {"_id": 0, "id": 1, "name": 1, "highest_bid": 1, "highest_bidder": 1}
+        )
+        return [{
+            "product_id": p.get("id"),
+            "product_name": p.get("name"),
+            "amount": p.get("highest_bid", 0),
+            "user_id": p.get("highest_bidder")
+        } for p in prods]
+
+    def _poll(self, auction_id):
+        seen = self._highest.setdefault(auction_id, {})
+        for row in self.snapshot(auction_id):
+            current = (row["amount"], row["user_id"])
+            previous = seen.get(row["product_id"])
+            if previous != current:
+                seen[row["product_id"]] = current
+                # Every accepted bid raises the highest bid, so a change after
+                # the first read is a bid made elsewhere (the latest, if several)
+                if previous is not None:
+                    self.publish(auction_id, "new_bid", row)
+                self.publish(auction_id, "highest_bid", row)
+
+    def _pump(self, auction_id):
+        while True:
+            with self._lock:
+                if not self._subscribers.get(auction_id):
+                    self._pumps.pop(auction_id, None)
+                    self._highest.pop(auction_id, None)
+                    return
+            try:
+                self._poll(auction_id)
+                deadline = auction_clock.deadline(auction_id)
+                remaining = seconds_left(deadline) if deadline else 0
+                self.publish(auction_id, "tick", {"auction_id": auction_id, "time_remaining_seconds": remaining})
+                if remaining == 0 and auction_clock.has_ended(auction_id, datetime.utcnow()):
+                    self.publish(auction_id, "closed", {"auction_id": auction_id})
+            except Exception as e:
+                log.error(f"Stream pump for auction {auction_id} failed: {e}")
+            time.sleep(self.tick)
+
+
+auction_stream = AuctionStream()
@@ -0,0 +1,266 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from bson import json_util
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+log = logging.getLogger(__name__)
+
+# Flush when this many records are waiting, or when the oldest has waited this long.
+MAX_BATCH = 256
+MAX_DELAY = 0.005
+# Bounded queue: submitters block for up to PUT_TIMEOUT, then write inline.
+MAX_QUEUE = 10000
+PUT_TIMEOUT = 0.5
+# A failed batch is retried, backing off from RETRY_MIN to RETRY_MAX seconds,
+# until it is written. Documents Mongo itself rejects go to DEAD_LETTERS.
+RETRY_MIN = 0.05
+RETRY_MAX = 5.0
+DEAD_LETTERS = "write_failures"
+DUPLICATE_KEY = 11000
+
+
+class GroupCommitWriter:
+    """
+    Group-commit writer for the bid path: appends to bids and transactions,
+    and updates to the embedded bid history on products.
+
+    Records are queued and flushed by one background thread, inserts with
+    insert_many(ordered=False) and updates with bulk_write(ordered=False),
+    so a burst of bids costs a handful of round trips instead of one per
+    record.
+
+    Nothing queued is dropped: a batch that fails is retried until Mongo
+    takes it, and while it is stuck the queue fills up so new writes fall
+    back to the request thread and fail there. Updates may be applied
+    twice on a retry, so their filter must skip documents they already
+    changed.
+    """
+
+    def __init__(self, max_batch=MAX_BATCH, max_delay=MAX_DELAY, max_queue=MAX_QUEUE, put_timeout=PUT_TIMEOUT):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        # Records queued and records written so far; flush() waits on these
+        # instead of queue.join(), which never returns under steady load.
+        self._submitted = 0
+        self._completed = 0
+        self._progress = threading.Condition()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "docs": 0,
+            "updates": 0,
+            "max_batch_size": 0,
+            "flush_ms_total": 0.0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "inline_writes": 0,
+            "retries": 0,
+            "failed_docs": 0,
+        }
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+
+    def _put(self, item):
+        """Queue `item`, blocking up to put_timeout; False if the queue stayed full."""
+        self._ensure_thread()
+        deadline = time.monotonic() + self.put_timeout
+        while True:
+            # Counting and queueing together keeps the count in queue order
+            with self._progress:
+                try:
+                    self._queue.put_nowait(item)
+                    self._submitted += 1
+                    return True
+                except queue.Full:
+                    pass
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(0.001)
+        # Writer can't keep up: make the caller pay for its own write.
+        with self._stats_lock:
+            self._stats["inline_writes"] += 1
+        return False
+
+    def submit(self, collection, doc):
+        """Queue `doc` for insert into `collection`; applies back-pressure when the queue is full."""
+        if not self._put((collection, "insert", doc)):
+            collection.insert_one(doc)
+
+    def submit_update(self, collection, filter, update):
+        """Queue an update_one; `filter` must not match once `update` has been applied."""
+        if not self._put((collection, "update", (filter, update))):
+            collection.update_one(filter, update)
+
+    def _take_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        grouped = {}
+        for collection, op, record in batch:
+            grouped.setdefault((collection.full_name, op), (collection, op, []))[2].append(record)
+
+        started = time.perf_counter()
+        pending = list(grouped.values())
+        updates = sum(len(records) for _, op, records in pending if op == "update")
+        failed = 0
+        delay = RETRY_MIN
+        while True:
+            retry = []
+            for collection, op, records in pending:
+                write = self._insert if op == "insert" else self._update
+                retry_records, rejected = write(collection, records)
+                if retry_records:
+                    retry.append((collection, op, retry_records))
+                if rejected:
+                    failed += len(rejected)
+                    retry.append((collection.database[DEAD_LETTERS], "insert", rejected))
+            if not retry:
+                break
+            pending = retry
+            with self._stats_lock:
+                self._stats["retries"] += 1
+            time.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with self._stats_lock:
+            s = self._stats
+            s["batches"] += 1
+            s["docs"] += len(batch)
+            s["updates"] += updates
+            s["max_batch_size"] = max(s["max_batch_size"], len(batch))
+            s["flush_ms_total"] += elapsed_ms
+            s["last_flush_ms"] = elapsed_ms
+            s["max_flush_ms"] = max(s["max_flush_ms"], elapsed_ms)
+            s["failed_docs"] += failed
+
+    def _insert(self, collection, docs):
+        """
+        insert_many `docs`; returns (docs to retry, dead letters for docs
+        Mongo rejected). insert_many gives every doc its _id up front, so a
+        retry of a doc that did land fails as a duplicate and is skipped.
+        """
+        try:
+            collection.insert_many(docs, ordered=False)
+            return [], []
+        except BulkWriteError as e:
+            if e.details.get("writeConcernErrors"):
+                log.warning(f"Group commit to {collection.name} not acknowledged, retrying: {e.details['writeConcernErrors'][:1]}")
+                return docs, []
+            rejected = []
+            for err in e.details.get("writeErrors", []):
+                if err.get("code") == DUPLICATE_KEY:
+                    continue
+                if collection.name == DEAD_LETTERS:
+                    log.error(f"Dropping dead letter {docs[err['index']].get('_id')}: {err.get('errmsg')}")
+                    continue
+                log.error(f"Group commit to {collection.name} rejected a document: {err.get('errmsg')}")
+                rejected.append({
+                    "collection": collection.name,
+                    "doc": docs[err["index"]],
+                    "error": err.get("errmsg"),
+                    "failed_at": datetime.utcnow()
+                })
+            return [], rejected
+        except PyMongoError as e:
+            log.error(f"Group commit to {collection.name} failed, retrying: {e}")
+            return docs, []
+
+    def _update(self, collection, updates):
+        """
+        bulk_write the (filter, update) pairs; returns (updates to retry,
+        dead letters for updates Mongo rejected). A retry re-runs updates
+        that already landed, which their filters turn into no-ops.
+        """
+        try:
+            collection.bulk_write([UpdateOne(f, u) for f, u in updates], ordered=False)
+            return [], []
+        except BulkWriteError as e:
+            if e.details.get("writeConcernErrors"):
+                log.warning(f"Group commit to {collection.name} not acknowledged, retrying: {e.details['writeConcernErrors'][:1]}")
+                return updates, []
+            rejected = []
+            for err in e.details.get("writeErrors", []):
+                log.error(f"Group commit to {collection.name} rejected an update: {err.get('errmsg')}")
+                f, u = updates[err["index"]]
+                rejected.append({
+                    "collection": collection.name,
+                    # Extended JSON: operator keys like $push can't be stored as field names
+                    "update": json_util.dumps({"filter": f, "update": u}),
+                    "error": err.get("errmsg"),
+                    "failed_at": datetime.utcnow()
+                })
+            return [], rejected
+        except PyMongoError as e:
+            log.error(f"Group commit to {collection.name} failed, retrying: {e}")
+            return updates, []
+
+    def _done(self, count):
+        with self._progress:
+            self._completed += count
+            self._progress.notify_all()
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                self._write(batch)
+            finally:
+                self._done(len(batch))
+
+    def flush(self):
+        """Block until every record queued before this call has been written."""
+        with self._progress:
+            target = self._submitted
+        if self._thread is not None and self._thread.is_alive():
+            with self._progress:
+                self._progress.wait_for(lambda: self._completed >= target)
+            return
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            try:
+                self._write(batch)
+            finally:
+                self._done(len(batch))
+
+    def stats(self):
+        with self._stats_lock:
+            s = dict(self._stats)
+        s["queue_depth"] = self._queue.qsize()
+        s["avg_batch_size"] = round(s["docs"] / s["batches"], 2) if s["batches"] else 0
+        s["avg_flush_ms"] = round(s.pop("flush_ms_total") / s["batches"], 3) if s["batches"] else 0
+        return s
+
+
+audit_writer = GroupCommitWriter()
+atexit.register(audit_writer.flush)
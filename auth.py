@@ -1,9 +1,11 @@
 from flask import Blueprint, request, jsonify,make_response,current_app as app
 from pymongo import MongoClient
+from pymongo.errors import PyMongoError
 from datetime import datetime, timedelta
-import bcrypt
+from passwords import PasswordPoolBusy, password_hasher, stored_rounds
 import jwt
 from tokenCheck import token_required
+from rateLimits import LOGIN_IP_LIMIT, LOGIN_LIMIT, REGISTER_LIMIT, client_ip, limiter, login_key
 from db import DB_NAME,MONGO_URI,db,SECRET_KEY
 
 # from db import DB_NAME,MONGO_URI,SECRET_KEY
@@ -21,7 +23,36 @@ transactions=db["transactions"]
 auth_bp = Blueprint('auth', __name__)
 
 
+@auth_bp.errorhandler(PasswordPoolBusy)
+def password_pool_busy(e):
+    response = jsonify({"error": "Too many sign-in requests, please retry shortly"})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, 503
+
+
+def rehash_password(collection, account, password):
+    """Re-hash at the pinned cost after a successful login, if the stored cost differs."""
+    if not password_hasher.needs_rehash(account["password"]):
+        return
+    old_rounds = stored_rounds(account["password"])
+    if old_rounds is not None and old_rounds > password_hasher.rounds:
+        app.logger.warning(
+            f"Lowering bcrypt cost for {account.get('username')} from {old_rounds} to {password_hasher.rounds}"
+        )
+    try:
+        # Matching the old hash keeps a concurrent password change from being overwritten
+        collection.update_one(
+            {"_id": account["_id"], "password": account["password"]},
+            {"$set": {"password": password_hasher.hash(password)}}
+        )
+    except PasswordPoolBusy:
+        pass  # try again on a later login
+    except PyMongoError as e:
+        app.logger.error(f"Failed to rehash password for {account.get('username')}: {e}")
+
+
 @auth_bp.route("/register", methods=["POST"])
+@limiter.limit(REGISTER_LIMIT, key_func=client_ip)
 def register():
     data = request.json
     name = data.get("name")
@@ -36,11 +67,11 @@ def register():
     if existing_user:
         return jsonify({"error": "Username already exists"}), 400
 
-    hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    hashed_pw = password_hasher.hash(password)
     users.insert_one({
         "name": name,
         "username": username,
-        "password": hashed_pw.decode('utf-8'),
+        "password": hashed_pw,
         "mobile_number": mobile,
         "auctions":[],
         "wallet_balance":500.0
@@ -51,6 +82,8 @@ def register():
 
 # ---------------- LOGIN ------------------
 @auth_bp.route("/login", methods=["POST"])
+@limiter.limit(LOGIN_LIMIT, key_func=login_key)
+@limiter.limit(LOGIN_IP_LIMIT, key_func=client_ip)
 def login():
     data = request.json
     username = data.get("username")
@@ -63,7 +96,8 @@ def login():
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    if bcrypt.checkpw(password.encode('utf-8'), user["password"].encode('utf-8')):
+    if password_hasher.check(password, user["password"]):
+        rehash_password(users, user, password)
         payload = {
             "user_id": str(user["_id"]),
             "username": user["username"],
@@ -103,6 +137,7 @@ def login():
 # --------------- CHANGE PASSWORD ------------------
 
 @auth_bp.route("/change-password", methods=["POST"])
+@limiter.limit(LOGIN_LIMIT, key_func=login_key)
 @token_required
 def change_password(decoded_token):
     data = request.json
@@ -117,19 +152,21 @@ def change_password(decoded_token):
     if not user:
         return jsonify({"error": "User not found"}), 404
 
-    if not bcrypt.checkpw(old_password.encode('utf-8'), user["password"].encode('utf-8')):
+    if not password_hasher.check(old_password, user["password"]):
         return jsonify({"error": "Incorrect current password"}), 401
 
-    hashed_new_pw = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+    hashed_new_pw = password_hasher.hash(new_password)
     users.update_one(
         {"_id": user["_id"]},
-        {"$set": {"password": hashed_new_pw.decode('utf-8')}}
+        {"$set": {"password": hashed_new_pw}}
     )
 
     return jsonify({"message": "Password updated successfully"}), 200
 
 
 @auth_bp.route("/admin/login", methods=["POST"])
+@limiter.limit(LOGIN_LIMIT, key_func=login_key)
+@limiter.limit(LOGIN_IP_LIMIT, key_func=client_ip)
 def admin_login():
     data = request.json
     username = data.get("username")
@@ -143,7 +180,8 @@ def admin_login():
     if not admin:
         return jsonify({"error": "Admin not found"}), 404
 
-    if bcrypt.checkpw(password.encode('utf-8'), admin["password"].encode('utf-8')):
+    if password_hasher.check(password, admin["password"]):
+        rehash_password(admins, admin, password)
         payload = {
             "admin_id": str(admin["_id"]),
             "username": admin["username"],
@@ -181,6 +219,7 @@ def admin_login():
 
 
 @auth_bp.route("/admin/register", methods=["POST"])
+@limiter.limit(REGISTER_LIMIT, key_func=client_ip)
 def admin_register():
     data = request.json
 
@@ -200,13 +239,13 @@ def admin_register():
         return jsonify({"error": "Admin username already exists"}), 400
 
     # ✅ Hash the password
-    hashed_pw = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    hashed_pw = password_hasher.hash(password)
 
     # ✅ Insert admin
     admin_doc = {
         "name": name,
         "username": username,
-        "password": hashed_pw.decode('utf-8'),
+        "password": hashed_pw,
         "mobile_number": mobile,
         "role": role,
         "created_at": datetime.utcnow()
@@ -217,6 +256,7 @@ def admin_register():
     return jsonify({"message": "Admin registered successfully"}), 200
 
 @auth_bp.route("/admin/change-password", methods=["POST"])
+@limiter.limit(LOGIN_LIMIT, key_func=login_key)
 @token_required
 def admin_change_password(decoded_token):
     data = request.json
@@ -232,13 +272,13 @@ def admin_change_password(decoded_token):
     if not admin:
         return jsonify({"error": "Admin not found"}), 404
 
-    if not bcrypt.checkpw(old_password.encode('utf-8'), admin["password"].encode('utf-8')):
+    if not password_hasher.check(old_password, admin["password"]):
         return jsonify({"error": "Incorrect current password"}), 401
 
-    hashed_pw = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+    hashed_pw = password_hasher.hash(new_password)
     admins.update_one(
         {"_id": admin["_id"]},
-        {"$set": {"password": hashed_pw.decode('utf-8')}}
+        {"$set": {"password": hashed_pw}}
     )
 
     return jsonify({"message": "Password updated successfully"}), 200
@@ -1,3 +1,5 @@
+import multiprocessing
+import time
 from flask import Flask, jsonify
 import pytz
 from flask_cors import CORS
@@ -5,12 +7,22 @@ from admins import admin_bp
 from auth import auth_bp
 from wallet import wallet_bp
 from users import user_bp
+from streamServer import stream_bp
+from orderBook import order_book
+from auditWriter import audit_writer
+from productResolver import product_resolver
+from passwords import password_hasher
+from tokenCheck import token_cache
+from rateLimits import limiter
+from settlementScheduler import settlement_scheduler, ENABLED as settlement_scheduler_enabled
+from jobs import job_runner, ENABLED as job_runner_enabled
 
 app = Flask(__name__)
 app.register_blueprint(admin_bp, url_prefix='/')
 app.register_blueprint(auth_bp, url_prefix='/')
 app.register_blueprint(wallet_bp, url_prefix='/')
 app.register_blueprint(user_bp, url_prefix='/')
+app.register_blueprint(stream_bp, url_prefix='/')
 
 from flask_cors import CORS
 
@@ -18,10 +30,61 @@ CORS(app,
      supports_credentials=True,
      origins="*",
      allow_headers=["Content-Type", "Authorization"],
+     expose_headers=["X-Next-Cursor"],
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
 
 utc = pytz.utc
 
+# Per-user / per-IP limits, shared by the workers on this host
+limiter.init_app(app)
+
+
+@app.errorhandler(429)
+def rate_limited(e):
+    response = jsonify({"error": f"Rate limit exceeded: {e.description}"})
+    limit = limiter.current_limit
+    if limit is not None:
+        response.headers["Retry-After"] = str(max(limit.reset_at - int(time.time()), 1))
+    return response, 429
+
+
+def start_background_work():
+    # Warm the in-memory order books for live lots
+    try:
+        app.logger.info(f"Order book loaded for {order_book.rebuild()} products")
+    except Exception as e:
+        app.logger.error(f"Failed to rebuild order book: {e}")
+
+    # Tune the bcrypt cost to this host (or BCRYPT_ROUNDS) before the first login
+    app.logger.info(f"bcrypt cost factor {password_hasher.rounds}")
+
+    # Settle auctions as they close
+    if settlement_scheduler_enabled:
+        try:
+            app.logger.info(f"Settlement scheduler tracking {settlement_scheduler.start()} auctions")
+        except Exception as e:
+            app.logger.error(f"Failed to start settlement scheduler: {e}")
+
+    # Background cascade deletes, resumed after restarts
+    if job_runner_enabled:
+        job_runner.start()
+
+
+# bcrypt helper processes re-import the main module when the app is run with
+# `python backend.py`; only the app process itself starts background work.
+if multiprocessing.parent_process() is None:
+    start_background_work()
+
+
+@app.route("/metrics")
+def metrics():
+    return jsonify({
+        "audit_writer": audit_writer.stats(),
+        "product_resolver": product_resolver.stats(),
+        "password_hasher": password_hasher.stats(),
+        "token_cache": token_cache.stats()
+    }), 200
+
 
 @app.route("/")
 def home():
@@ -111,6 +174,18 @@ def home():
         "description": "List products in an auction",
         "example": "/auctions/123/products"
       },
+      "auction_snapshot": {
+        "method": "GET",
+        "path": "/auctions/<auction_id>/snapshot",
+        "description": "Auction metadata, unsold products, top bid and bidder, bid counts and seconds remaining",
+        "example": "/auctions/123/snapshot"
+      },
+      "stream_auction": {
+        "method": "GET",
+        "path": "/auctions/<auction_id>/stream",
+        "description": "Server-Sent Events stream of snapshot, highest_bid, new_bid, tick and closed events",
+        "example": "/auctions/123/stream"
+      },
       "register_for_auction": {
         "method": "POST",
         "path": "/auctions/register",
@@ -138,9 +213,13 @@ def home():
       "get_user_bids": {
         "method": "GET",
         "path": "/user-bids",
-        "description": "Get all bids by the current user",
+        "description": "Get bids by the current user, newest first",
         "headers": {
           "Authorization": "Bearer <token>"
+        },
+        "query_params": {
+          "limit": "page size (default 50, max 200)",
+          "after": "value of the X-Next-Cursor header from the previous page"
         }
       },
       "get_user_bids_for_auction": {
@@ -155,9 +234,11 @@ def home():
       "get_all_bids": {
         "method": "GET",
         "path": "/bids",
-        "description": "Get all bids for a product",
+        "description": "Get bids for a product, newest first",
         "query_params": {
-          "product_key": "product_id_or_name"
+          "product_key": "product_id_or_name",
+          "limit": "page size (default 50, max 200)",
+          "after": "value of the X-Next-Cursor header from the previous page"
         },
         "example": "/bids?product_key=prod1"
       },
@@ -170,6 +251,18 @@ def home():
         },
         "example": "/highest-bid?product_key=prod1"
       },
+      "get_products_status": {
+        "method": "GET or POST",
+        "path": "/products/status",
+        "description": "Highest bid, bid count, status and time remaining for several products at once",
+        "query_params": {
+          "product_keys": "comma-separated product ids or names"
+        },
+        "sample_request": {
+          "product_keys": ["prod1", "prod2", "Product 3"]
+        },
+        "example": "/products/status?product_keys=prod1,prod2"
+      },
       "get_time_left": {
         "method": "GET",
         "path": "/time-left",
@@ -203,9 +296,13 @@ def home():
       "get_wallet_transactions": {
         "method": "GET",
         "path": "/wallet/transactions",
-        "description": "Get wallet transaction history",
+        "description": "Get wallet transaction history, newest first",
         "headers": {
           "Authorization": "Bearer <token>"
+        },
+        "query_params": {
+          "limit": "page size (default 50, max 200)",
+          "after": "next_cursor from the previous page"
         }
       },
       "rollback_bid": {
@@ -250,7 +347,7 @@ def home():
       "delete_auction": {
         "method": "DELETE",
         "path": "/admin/auction/<auction_id>",
-        "description": "Delete an auction",
+        "description": "Delete an auction; its bids and registrations are removed by a background job (see cleanup_job_id)",
         "headers": {
           "Authorization": "Bearer <token>"
         },
@@ -269,6 +366,16 @@ def home():
           "description": "Description of product"
         }
       },
+      "import_products": {
+        "method": "POST",
+        "path": "/admin/products/import",
+        "description": "Bulk-import products from an NDJSON or CSV body (columns id, name, description); reports per-row errors",
+        "headers": {
+          "Authorization": "Bearer <token>",
+          "Content-Type": "application/x-ndjson | text/csv"
+        },
+        "sample_request": "{\"id\": \"prod1\", \"name\": \"Product 1\", \"description\": \"Description of product\"}\n..."
+      },
       "update_product": {
         "method": "PUT",
         "path": "/admin/product/<product_id>",
@@ -286,7 +393,7 @@ def home():
       "delete_product": {
         "method": "DELETE",
         "path": "/admin/product/<product_id>",
-        "description": "Delete a product",
+        "description": "Delete a product; its bids are removed by a background job (see cleanup_job_id)",
         "headers": {
           "Authorization": "Bearer <token>"
         },
@@ -331,11 +438,27 @@ def home():
       "settle_auction": {
         "method": "POST",
         "path": "/admin/auction/<auction_id>/settle",
-        "description": "Finalize auction and determine winners",
+        "description": "Finalize auction, determine winners and refund outbid bids",
         "headers": {
           "Authorization": "Bearer <token>"
         },
         "example": "/admin/auction/auction123/settle"
+      },
+      "get_job": {
+        "method": "GET",
+        "path": "/admin/jobs/<job_id>",
+        "description": "Progress of a background cleanup job",
+        "headers": {
+          "Authorization": "Bearer <token>"
+        },
+        "example": "/admin/jobs/64f0c2a1e4b0a1b2c3d4e5f6"
+      }
+    },
+    "system_operations": {
+      "metrics": {
+        "method": "GET",
+        "path": "/metrics",
+        "description": "In-process performance counters for this worker"
       }
     }
   },
@@ -0,0 +1,231 @@
+"""
+Bid path benchmark: POST /bid against the handler it replaced (a user,
+product and auction read, a max() over the embedded bids, then four
+separate writes), both driven through the Flask app by concurrent bidders
+on a scratch database that is dropped first.
+
+    MONGO_URI=mongodb://localhost:27017 python benchBids.py [--db auction_bench] [--bidders 16] [--bids 2000] [--lots 20]
+
+Every bid raises the lot's price, so nearly all of them are accepted.
+Throughput includes waiting for the group-commit writer to drain.
+"""
+import argparse
+import itertools
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+
+load_dotenv()
+APP_DB_NAME = os.getenv("DB_NAME")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark bid placement")
+    parser.add_argument("--db", default="auction_bench", help="Scratch database, dropped before each run")
+    parser.add_argument("--bidders", type=int, default=16, help="Concurrent bidders")
+    parser.add_argument("--bids", type=int, default=2000, help="Bids per path")
+    parser.add_argument("--lots", type=int, default=20)
+    return parser.parse_args()
+
+
+# db.py connects on import, so the scratch database is picked first
+args = parse_args()
+if not os.getenv("MONGO_URI"):
+    sys.exit("Set MONGO_URI")
+if args.db == APP_DB_NAME:
+    sys.exit(f"Refusing to drop the application database {args.db!r}; pass another --db")
+os.environ["DB_NAME"] = args.db
+os.environ["SETTLEMENT_SCHEDULER"] = "off"
+os.environ["JOB_RUNNER"] = "off"
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+from flask import jsonify, request  # noqa: E402
+from db import client, db  # noqa: E402
+from indexes import create_indexes  # noqa: E402
+from auctionClock import parse_deadline  # noqa: E402
+from auditWriter import audit_writer  # noqa: E402
+from rateLimits import limiter  # noqa: E402
+from backend import app  # noqa: E402
+
+products = db["products"]
+bids = db["bids"]
+auctions = db["auctions"]
+users = db["users"]
+registrations = db["registrations"]
+transactions = db["transactions"]
+
+
+def legacy_place_bid():
+    """place_bid as it was before the bid engine, minus its error wrapper."""
+    data = request.get_json()
+    product_key = data.get("product_name")
+    bid_amount = data.get("bid_amount")
+    username = data.get("user_id")
+    now = datetime.utcnow()
+
+    user = users.find_one({"username": username})
+    if not user:
+        return jsonify({"success": False, "message": "User not found"}), 404
+    if user.get("wallet_balance", 0) < bid_amount:
+        return jsonify({"success": False, "message": "Insufficient wallet balance"}), 400
+
+    try:
+        prod_id_int = int(product_key)
+    except (ValueError, TypeError):
+        prod_id_int = None
+    product = products.find_one({"$or": [{"id": product_key}, {"id": prod_id_int}, {"name": product_key}]})
+    if not product:
+        return jsonify({"success": False, "message": "Product not found"}), 404
+    if product.get("status") == "sold":
+        return jsonify({"success": False, "message": "Product already sold"}), 400
+    auction_id = product.get("auction_id")
+
+    auction = auctions.find_one({"id": auction_id})
+    if not auction:
+        return jsonify({"success": False, "message": "Auction not found"}), 404
+    if now >= parse_deadline(auction["valid_until"]):
+        return jsonify({"success": False, "message": "Auction has ended"}), 400
+    if str(user.get("_id")) not in [str(r) for r in auction.get("registrations", [])]:
+        return jsonify({"success": False, "message": "User not registered for this auction"}), 403
+
+    max_bid = max([b.get("amount", 0) for b in product.get("bids", [])], default=0)
+    if bid_amount <= max_bid:
+        return jsonify({"success": False, "message": f"Bid must be higher than current max of ₹{max_bid}"}), 400
+
+    users.update_one({"username": username}, {"$inc": {"wallet_balance": -bid_amount}})
+    bids.insert_one({
+        "product_id": product.get("id"),
+        "product_name": product.get("name"),
+        "auction_id": auction_id,
+        "amount": bid_amount,
+        "timestamp": now,
+        "status": "success",
+        "user_id": username
+    })
+    transactions.insert_one({
+        "username": username,
+        "type": "bid",
+        "amount": bid_amount,
+        "timestamp": now,
+        "meta": {"product_id": product.get("id"), "notes": f"Bid placed on {product.get('name')}"}
+    })
+    products.update_one(
+        {"_id": product["_id"]},
+        {"$push": {"bids": {"amount": bid_amount, "timestamp": now, "user_id": username}}}
+    )
+    return jsonify({"success": True, "message": "Bid placed successfully"}), 201
+
+
+app.add_url_rule("/bench/legacy-bid", "legacy_bid", legacy_place_bid, methods=["POST"])
+
+
+def seed(auction_id, lots, bidders):
+    """A live auction with every bidder registered, both the old way and the new."""
+    user_ids = users.insert_many([
+        {"username": f"{auction_id}-bidder{b}", "wallet_balance": 10 ** 12, "auctions": [auction_id]}
+        for b in range(bidders)
+    ]).inserted_ids
+    product_ids = [f"{auction_id}-p{i}" for i in range(lots)]
+    auctions.insert_one({
+        "id": auction_id,
+        "name": auction_id,
+        "product_ids": product_ids,
+        "valid_until": datetime.utcnow() + timedelta(hours=1),
+        "settled": False,
+        "registrations": [str(uid) for uid in user_ids],
+    })
+    registrations.insert_many([
+        {"auction_id": auction_id, "user_id": str(uid), "registered_at": datetime.utcnow()} for uid in user_ids
+    ])
+    products.insert_many([
+        {
+            "id": product_id,
+            "name": product_id,
+            "auction_id": auction_id,
+            "status": "unsold",
+            "sold_to": None,
+            "bids": [],
+            "highest_bid": 0,
+            "highest_bidder": None,
+            "bid_count": 0,
+        }
+        for product_id in product_ids
+    ])
+    return product_ids
+
+
+def run(path, auction_id):
+    product_ids = seed(auction_id, args.lots, args.bidders)
+    amounts = itertools.count(1)
+    amounts_lock = threading.Lock()
+    latencies = []
+    statuses = {}
+
+    def bidder(b):
+        c = app.test_client()
+        username = f"{auction_id}-bidder{b}"
+        mine, codes = [], {}
+        for i in range(b, args.bids, args.bidders):
+            with amounts_lock:
+                amount = next(amounts)
+            started = time.perf_counter()
+            res = c.post(path, json={
+                "product_name": product_ids[i % len(product_ids)],
+                "bid_amount": amount,
+                "user_id": username
+            })
+            mine.append(time.perf_counter() - started)
+            codes[res.status_code] = codes.get(res.status_code, 0) + 1
+        return mine, codes
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.bidders) as pool:
+        for mine, codes in pool.map(bidder, range(args.bidders)):
+            latencies.extend(mine)
+            for code, n in codes.items():
+                statuses[code] = statuses.get(code, 0) + n
+    audit_writer.flush()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000
+
+    return {
+        "bids/s": len(latencies) / elapsed,
+        "p50 ms": pct(0.50),
+        "p99 ms": pct(0.99),
+        "max ms": latencies[-1] * 1000,
+        "statuses": dict(sorted(statuses.items())),
+    }
+
+
+def main():
+    client.drop_database(args.db)
+    failures = create_indexes()
+    if failures:
+        sys.exit(f"Index creation failed: {failures}")
+    # Every bench bidder is one client on one address
+    limiter.enabled = False
+
+    results = {
+        "old handler": run("/bench/legacy-bid", "old"),
+        "POST /bid": run("/bid", "new"),
+    }
+    print(f"{args.bids} bids, {args.bidders} concurrent bidders, {args.lots} lots")
+    print(f"{'path':<12} {'bids/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}  statuses")
+    for name, r in results.items():
+        print(f"{name:<12} {r['bids/s']:>9.0f} {r['p50 ms']:>8.2f} {r['p99 ms']:>8.2f} {r['max ms']:>8.2f}  {r['statuses']}")
+    old, new = results["old handler"], results["POST /bid"]
+    print(f"throughput {new['bids/s'] / old['bids/s']:.1f}x, p99 {old['p99 ms'] / new['p99 ms']:.1f}x lower")
+
+    client.drop_database(args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Settlement benchmark: settle() against the old per-lot loop (find_one,
+bids.find_one sorted by amount, update_one per product) for auctions of
+10, 100 and 1,000 lots, on a scratch database that is dropped first.
+
+    MONGO_URI=mongodb://localhost:27017 python benchSettlement.py [--db auction_bench] [--lots 10 100 1000] [--bidders 5]
+
+settle() also refunds the outbid bids, which the old loop never did; its
+refund report is printed alongside.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+
+load_dotenv()
+APP_DB_NAME = os.getenv("DB_NAME")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark auction settlement")
+    parser.add_argument("--db", default="auction_bench", help="Scratch database, dropped before each run")
+    parser.add_argument("--lots", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--bidders", type=int, default=5, help="Bids per lot, one per bidder")
+    return parser.parse_args()
+
+
+# db.py connects on import, so the scratch database is picked first
+args = parse_args()
+if not os.getenv("MONGO_URI"):
+    sys.exit("Set MONGO_URI")
+if args.db == APP_DB_NAME:
+    sys.exit(f"Refusing to drop the application database {args.db!r}; pass another --db")
+os.environ["DB_NAME"] = args.db
+
+from db import client, db  # noqa: E402
+from indexes import create_indexes  # noqa: E402
+import settlement  # noqa: E402
+
+products = db["products"]
+bids = db["bids"]
+auctions = db["auctions"]
+users = db["users"]
+
+
+def seed(auction_id, lots, bidders):
+    """An expired auction of `lots` products; every tenth lot gets no bids."""
+    now = datetime.utcnow()
+    product_ids = [f"{auction_id}-p{i}" for i in range(lots)]
+    auctions.insert_one({
+        "id": auction_id,
+        "name": auction_id,
+        "product_ids": product_ids,
+        "valid_until": now - timedelta(minutes=5),
+        "settled": False,
+    })
+    product_docs, bid_docs = [], []
+    for i, product_id in enumerate(product_ids):
+        amounts = [] if i % 10 == 9 else [100 + 10 * b + i for b in range(bidders)]
+        for b, amount in enumerate(amounts):
+            bid_docs.append({
+                "product_id": product_id,
+                "auction_id": auction_id,
+                "amount": amount,
+                "timestamp": now - timedelta(minutes=10),
+                "status": "success",
+                "user_id": f"bidder{b}",
+            })
+        product_docs.append({
+            "id": product_id,
+            "name": product_id,
+            "auction_id": auction_id,
+            "status": "unsold",
+            "sold_to": None,
+            "highest_bid": amounts[-1] if amounts else 0,
+            "highest_bidder": f"bidder{len(amounts) - 1}" if amounts else None,
+            "bid_count": len(amounts),
+        })
+    products.insert_many(product_docs)
+    if bid_docs:
+        bids.insert_many(bid_docs)
+    return auctions.find_one({"id": auction_id})
+
+
+def legacy_settle(auction):
+    """The per-lot loop settle_auction ran before settlement went set-based."""
+    missing_products = []
+    settled_products = []
+    for product_id in auction["product_ids"]:
+        product = products.find_one({"id": product_id})
+        if not product:
+            missing_products.append(product_id)
+            continue
+        highest_bid = bids.find_one({"product_id": product_id}, sort=[("amount", -1)])
+        if highest_bid:
+            products.update_one({"id": product_id}, {"$set": {"status": "sold", "sold_to": highest_bid["user_id"]}})
+            settled_products.append({"product_id": product_id, "status": "sold", "sold_to": highest_bid["user_id"]})
+        else:
+            products.update_one({"id": product_id}, {"$set": {"status": "unsold", "sold_to": None}})
+            settled_products.append({"product_id": product_id, "status": "unsold", "sold_to": None})
+    auctions.update_one({"id": auction["id"]}, {"$set": {"settled": True, "settled_at": datetime.utcnow()}})
+    return {"settled_products": settled_products, "missing_products": missing_products}
+
+
+def strip_ids(report, auction_id):
+    prefix = f"{auction_id}-"
+    return [
+        {**p, "product_id": p["product_id"][len(prefix):]} for p in report["settled_products"]
+    ], report["missing_products"]
+
+
+def main():
+    client.drop_database(args.db)
+    failures = create_indexes()
+    if failures:
+        sys.exit(f"Index creation failed: {failures}")
+    users.insert_many([{"username": f"bidder{b}", "wallet_balance": 0} for b in range(args.bidders)])
+
+    print(f"{'lots':>6} {'old loop ms':>12} {'settle() ms':>12} {'speedup':>8}  refunds")
+    for lots in args.lots:
+        old = seed(f"old{lots}", lots, args.bidders)
+        started = time.perf_counter()
+        old_report = legacy_settle(old)
+        old_ms = (time.perf_counter() - started) * 1000
+
+        new = seed(f"new{lots}", lots, args.bidders)
+        started = time.perf_counter()
+        claimed = settlement.claim(new["id"])
+        new_report = settlement.settle(claimed, claimed["settle_lease_owner"])
+        new_ms = (time.perf_counter() - started) * 1000
+
+        same = strip_ids(old_report, old["id"]) == strip_ids(new_report, new["id"])
+        print(f"{lots:>6} {old_ms:>12.1f} {new_ms:>12.1f} {old_ms / new_ms:>7.1f}x  {new_report['refunds']}"
+              + ("" if same else "  REPORTS DIFFER"))
+
+    client.drop_database(args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+from pymongo import ReturnDocument
+from db import db
+
+products = db["products"]
+bids = db["bids"]
+users = db["users"]
+
+# The full history lives in the bids collection; products only carry the top N.
+EMBEDDED_TOP_BIDS = 10
+
+
+def empty_bid_fields():
+    """Denormalized bid fields for a product with no bids yet."""
+    return {"highest_bid": 0, "highest_bidder": None, "bid_count": 0}
+
+
+def debit_wallet(username, amount):
+    """Take `amount` from the wallet only if the balance covers it."""
+    res = users.update_one(
+        {"username": username, "wallet_balance": {"$gte": amount}},
+        {"$inc": {"wallet_balance": -amount}}
+    )
+    return res.modified_count == 1
+
+
+def credit_wallet(username, amount):
+    users.update_one({"username": username}, {"$inc": {"wallet_balance": amount}})
+
+
+def claim_highest_bid(product, username, amount, auction_id):
+    """
+    Accept a bid with a single conditional write.
+
+    The update only matches while the product is unsold, settlement of
+    `auction_id` hasn't closed it, and its current highest bid is below
+    `amount`, so concurrent bidders can't both win and no bid lands after
+    settlement has read the winners. Returns the updated highest bid
+    fields, or None if the bid lost the race.
+    """
+    return products.find_one_and_update(
+        {
+            "_id": product["_id"],
+            "status": "unsold",
+            "closed_auction_id": {"$ne": auction_id},
+            "$or": [
+                {"highest_bid": {"$lt": amount}},
+                {"highest_bid": {"$exists": False}}
+            ]
+        },
+        # Pipeline update: bid_count is only incremented once it exists, so
+        # products that predate it stay on the legacy count until backfilled.
+        [{"$set": {
+            "highest_bid": {"$literal": amount},
+            "highest_bidder": {"$literal": username},
+            "bid_count": {"$cond": [
+                {"$gt": ["$bid_count", None]},
+                {"$add": ["$bid_count", 1]},
+                "$$REMOVE"
+            ]}
+        }}],
+        projection={"highest_bid": 1, "highest_bidder": 1},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def embedded_bid_push(product_oid, bid):
+    """
+    (filter, update) adding `bid` to the product's top EMBEDDED_TOP_BIDS,
+    highest first. The filter skips a product that already holds the bid,
+    so a retried write doesn't add it twice.
+    """
+    return (
+        {"_id": product_oid, "bids": {"$not": {"$elemMatch": bid}}},
+        {"$push": {"bids": {
+            "$each": [bid],
+            "$sort": {"amount": -1},
+            "$slice": EMBEDDED_TOP_BIDS
+        }}}
+    )
+
+
+def top_bids(product_id, limit=EMBEDDED_TOP_BIDS):
+    return list(bids.find(
+        {"product_id": product_id},
+        {"_id": 0, "amount": 1, "timestamp": 1, "user_id": 1},
+        sort=[("amount", -1)],
+        limit=limit
+    ))
+
+
+def recompute_highest_bid(product_id):
+    """Re-derive the denormalized highest bid and embedded top bids after a bid is removed."""
+    top = top_bids(product_id)
+    products.update_one(
+        {"id": product_id},
+        {"$set": {
+            "highest_bid": top[0]["amount"] if top else 0,
+            "highest_bidder": top[0]["user_id"] if top else None,
+            "bid_count": bids.count_documents({"product_id": product_id}),
+            "bids": top
+        }}
+    )
@@ -0,0 +1,23 @@
+"""
+Gunicorn settings for the API, picked up automatically from the working
+directory:
+
+    gunicorn backend:app
+
+Defaults to gunicorn's own single sync worker. Each worker runs its own
+settlement scheduler, job runner, bcrypt pool and caches, so scale out
+deliberately with WEB_CONCURRENCY (processes) and GUNICORN_THREADS
+(threads per process; more than one switches to gthread workers).
+"""
+import os
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+threads = int(os.getenv("GUNICORN_THREADS", "1"))
+
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+# Workers read this to decide how many streams they can hold.
+os.environ["GUNICORN_THREADS"] = str(threads)
@@ -0,0 +1,23 @@
+"""
+Gunicorn settings for the live auction stream server:
+
+    gunicorn -c gunicorn.streams.conf.py "streamServer:create_app()"
+
+gevent workers keep each watcher in a greenlet, so one process holds
+thousands of open streams without taking threads from the API.
+"""
+import os
+
+bind = os.getenv("STREAM_BIND", f"0.0.0.0:{os.getenv('STREAM_PORT', '8001')}")
+workers = int(os.getenv("STREAM_WORKERS", "1"))
+worker_class = "gevent"
+worker_connections = int(os.getenv("STREAM_CONNECTIONS", "10000"))
+
+# Streams send a keep-alive every 15 s; gevent workers heartbeat
+# independently of open requests.
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+# Keep a few connections for watchers being turned away with a 503.
+os.environ.setdefault("MAX_STREAMS_PER_WORKER", str(max(worker_connections - 100, 1)))
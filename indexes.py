@@ -0,0 +1,139 @@
+"""
+Index manifest for every collection, plus a deploy-time CLI.
+
+    python indexes.py create [collection ...]   # idempotent
+    python indexes.py verify                    # fails if a hot query does a COLLSCAN
+"""
+import sys
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from db import db
+from productResolver import product_lookup_query
+from pagination import KEYSET_SORT
+from auctionClock import live_auctions_query
+
+INDEXES = {
+    "bids": [
+        IndexModel([("product_id", ASCENDING), ("amount", DESCENDING)], name="product_amount"),
+        IndexModel([("product_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="product_timeline"),
+        IndexModel([("product_name", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="product_name_timeline"),
+        IndexModel([("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="user_timeline"),
+        IndexModel([("user_id", ASCENDING), ("auction_id", ASCENDING), ("timestamp", DESCENDING)], name="user_auction_timeline"),
+        IndexModel([("auction_id", ASCENDING), ("_id", ASCENDING)], name="auction_cleanup"),
+        IndexModel([("product_id", ASCENDING), ("_id", ASCENDING)], name="product_cleanup"),
+    ],
+    "transactions": [
+        IndexModel([("username", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)], name="user_timeline"),
+        IndexModel([("ref", ASCENDING)], unique=True, name="ref_unique",
+                   partialFilterExpression={"ref": {"$exists": True}}),
+    ],
+    "products": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("name", ASCENDING)], name="name"),
+        IndexModel([("auction_id", ASCENDING), ("status", ASCENDING)], name="auction_status"),
+        IndexModel([("admin_id", ASCENDING), ("auction_id", ASCENDING), ("status", ASCENDING)], name="admin_auction_status"),
+    ],
+    "auctions": [
+        IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+        IndexModel([("valid_until", ASCENDING)], name="valid_until"),
+        IndexModel([("created_by", ASCENDING)], name="created_by"),
+    ],
+    "users": [
+        IndexModel([("username", ASCENDING)], unique=True, name="username_unique"),
+    ],
+    "admins": [
+        IndexModel([("username", ASCENDING)], unique=True, name="username_unique"),
+    ],
+    "registrations": [
+        IndexModel([("auction_id", ASCENDING), ("user_id", ASCENDING)], unique=True, name="auction_user_unique"),
+        IndexModel([("auction_id", ASCENDING), ("_id", ASCENDING)], name="auction_cleanup"),
+    ],
+    "jobs": [
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created"),
+    ],
+}
+
+
+def create_indexes(collections=None):
+    """Create the manifest's indexes. Returns {collection: error} for failures."""
+    failures = {}
+    for name in collections or INDEXES:
+        try:
+            db[name].create_indexes(INDEXES[name])
+        except OperationFailure as e:
+            failures[name] = str(e)
+    return failures
+
+
+def hot_queries():
+    """(label, collection, filter, sort) for the query shape behind each endpoint."""
+    sample = "__index_check__"
+    return [
+        ("product resolver", "products", product_lookup_query(sample), None),
+        ("order book / settlement top bid", "bids", {"product_id": sample}, [("amount", -1)]),
+        ("/user-bids", "bids", {"user_id": sample}, KEYSET_SORT),
+        ("/user-bids/auction/<id>", "bids", {"user_id": sample, "auction_id": sample}, [("timestamp", -1)]),
+        ("/bids", "bids", {"$or": [{"product_id": sample}, {"product_name": sample}]}, KEYSET_SORT),
+        ("auction bids", "bids", {"auction_id": sample}, None),
+        ("/wallet/transactions", "transactions", {"username": sample}, KEYSET_SORT),
+        ("/auctions", "auctions", live_auctions_query(), None),
+        ("auction by id", "auctions", {"id": sample}, None),
+        ("/admin/auctions/my", "auctions", {"created_by": sample}, None),
+        ("/auctions/<id>/products", "products", {"auction_id": sample, "status": "unsold"}, None),
+        ("/admin/products/unassigned", "products", {"admin_id": sample, "auction_id": None, "status": "unsold"}, None),
+        ("login", "users", {"username": sample}, None),
+        ("admin login", "admins", {"username": sample, "role": "admin"}, None),
+        ("registration check", "registrations", {"auction_id": sample, "user_id": sample}, None),
+        ("cascade delete by auction", "bids", {"auction_id": sample}, [("_id", 1)]),
+        ("cascade delete by product", "bids", {"product_id": sample}, [("_id", 1)]),
+        ("cascade delete registrations", "registrations", {"auction_id": sample}, [("_id", 1)]),
+    ]
+
+
+def _stages(plan):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _stages(item)
+
+
+def verify():
+    """Explain every hot query; returns the labels whose winning plan scans the collection."""
+    collscans = []
+    for label, collection, query, sort in hot_queries():
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        stages = set(_stages(winning))
+        status = "COLLSCAN" if "COLLSCAN" in stages else "ok"
+        print(f"{status:8} {collection:14} {label}")
+        if status != "ok":
+            collscans.append(label)
+    return collscans
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("create", "verify"):
+        print(__doc__)
+        sys.exit(2)
+
+    if sys.argv[1] == "create":
+        unknown = [name for name in sys.argv[2:] if name not in INDEXES]
+        if unknown:
+            print(f"Unknown collections: {', '.join(unknown)}")
+            sys.exit(2)
+        failures = create_indexes(sys.argv[2:] or None)
+        for name, error in failures.items():
+            print(f"FAILED  {name}: {error}")
+        sys.exit(1 if failures else 0)
+
+    sys.exit(1 if verify() else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from db import db
+
+jobs = db["jobs"]
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.getenv("JOB_RUNNER", "on").lower() not in ("0", "off", "false")
+
+CHUNK_SIZE = 1000
+# Pause between chunks so a large cascade doesn't saturate the primary.
+THROTTLE_SECONDS = 0.05
+LEASE_SECONDS = 60
+IDLE_POLL_SECONDS = 5.0
+MAX_ATTEMPTS = 5
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_cascade_delete(label, targets):
+    """
+    Queue deletion of everything matching `targets`, a list of
+    (collection name, filter). Returns the job id as a string.
+
+    Only documents created before now are deleted, so an auction or product
+    re-created under the same id keeps its new bids and registrations.
+    """
+    now = datetime.utcnow()
+    # ObjectIds only resolve to the second; round up so this second's documents are included
+    cutoff = ObjectId.from_datetime(now + timedelta(seconds=1))
+    job = {
+        "type": "cascade_delete",
+        "label": label,
+        "targets": [
+            {"collection": name, "filter": dict(query, _id={"$lt": cutoff})}
+            for name, query in targets
+        ],
+        "step": 0,
+        "last_id": None,
+        "deleted": {},
+        "status": "pending",
+        "attempts": 0,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+        "finished_at": None,
+        "lease_owner": None,
+        "lease_expires_at": None
+    }
+    job_id = jobs.insert_one(job).inserted_id
+    job_runner.wake()
+    return str(job_id)
+
+
+def job_status(job_id):
+    """Public view of a job, or None if the id is unknown."""
+    try:
+        oid = ObjectId(job_id)
+    except (InvalidId, TypeError):
+        return None
+    job = jobs.find_one({"_id": oid}, {"targets": 0, "lease_owner": 0, "lease_expires_at": 0, "last_id": 0})
+    if not job:
+        return None
+    job["id"] = str(job.pop("_id"))
+    for key in ("created_at", "updated_at", "finished_at"):
+        if job.get(key):
+            job[key] = job[key].isoformat()
+    return job
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class JobRunner:
+    """
+    Works through queued jobs in the background. A job is claimed with a
+    lease on its document and its progress (current target and last _id
+    deleted) is saved after every chunk, so a job left behind by a crashed
+    or restarted worker resumes where it stopped once the lease runs out.
+    """
+
+    def __init__(self, owner=WORKER_ID):
+        self.owner = owner
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="job-runner", daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _claim(self):
+        now = datetime.utcnow()
+        return jobs.find_one_and_update(
+            {
+                "status": {"$in": ["pending", "running"]},
+                "$or": [{"lease_expires_at": None}, {"lease_expires_at": {"$lte": now}}]
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "lease_owner": self.owner,
+                    "lease_expires_at": now + timedelta(seconds=LEASE_SECONDS),
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _save(self, job_id, update):
+        now = datetime.utcnow()
+        update.setdefault("$set", {}).update({
+            "updated_at": now,
+            "lease_expires_at": now + timedelta(seconds=LEASE_SECONDS)
+        })
+        res = jobs.update_one({"_id": job_id, "lease_owner": self.owner}, update)
+        if res.matched_count == 0:
+            raise LeaseLost()
+
+    def _run_cascade(self, job):
+        targets = job["targets"]
+        step, last_id = job.get("step", 0), job.get("last_id")
+        while step < len(targets):
+            collection = db[targets[step]["collection"]]
+            query = dict(targets[step]["filter"])
+            if last_id is not None:
+                query["_id"] = dict(query.get("_id", {}), **{"$gt": last_id})
+            ids = [d["_id"] for d in collection.find(query, {"_id": 1}).sort("_id", 1).limit(CHUNK_SIZE)]
+            if not ids:
+                step, last_id = step + 1, None
+                self._save(job["_id"], {"$set": {"step": step, "last_id": None}})
+                continue
+            res = collection.delete_many({"_id": {"$in": ids}})
+            last_id = ids[-1]
+            self._save(job["_id"], {
+                "$set": {"last_id": last_id},
+                "$inc": {f"deleted.{collection.name}": res.deleted_count}
+            })
+            time.sleep(THROTTLE_SECONDS)
+
+    def _process(self, job):
+        try:
+            self._run_cascade(job)
+            self._save(job["_id"], {
+                "$set": {"status": "done", "finished_at": datetime.utcnow(), "error": None},
+                "$unset": {"lease_owner": ""}
+            })
+        except LeaseLost:
+            log.warning(f"Lost the lease on job {job['_id']}, another worker took over")
+        except Exception as e:
+            log.error(f"Job {job['_id']} failed: {e}")
+            failed = job.get("attempts", 0) >= MAX_ATTEMPTS
+            # Leave the lease to expire so the retry is delayed by LEASE_SECONDS
+            jobs.update_one({"_id": job["_id"], "lease_owner": self.owner}, {"$set": {
+                "status": "failed" if failed else "running",
+                "error": str(e),
+                "updated_at": datetime.utcnow()
+            }})
+
+    def _run(self):
+        while True:
+            try:
+                job = self._claim()
+            except Exception as e:
+                log.error(f"Failed to claim a job: {e}")
+                job = None
+            if job:
+                self._process(job)
+                continue
+            self._wake.wait(IDLE_POLL_SECONDS)
+            self._wake.clear()
+
+
+job_runner = JobRunner()
@@ -0,0 +1,299 @@
+"""
+One-off data migrations.
+
+    python migrations.py compact-bids [--dry-run] [--batch-size N]
+    python migrations.py backfill-registrations [--batch-size N]
+    python migrations.py backfill-bid-counts [--batch-size N]
+    python migrations.py convert-valid-until [--batch-size N] [--pause SECONDS]
+    python migrations.py check-links [--repair] [--batch-size N]
+    python migrations.py drop-refunded-auctions
+"""
+import argparse
+import time
+import bson
+from itertools import groupby
+from datetime import datetime
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+from db import db
+from bidEngine import EMBEDDED_TOP_BIDS
+from indexes import create_indexes
+from auctionClock import parse_deadline
+
+products = db["products"]
+bids = db["bids"]
+auctions = db["auctions"]
+registrations = db["registrations"]
+users = db["users"]
+
+
+def _decode_ms(raw, repeat=20):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        bson.decode(raw)
+    return (time.perf_counter() - started) * 1000 / repeat
+
+
+def compact_bids(dry_run=False, batch_size=500):
+    """
+    Trim every product's embedded bids to the sorted top EMBEDDED_TOP_BIDS,
+    backfilling highest_bid/highest_bidder on the way. Reports document size
+    and BSON decode cost before and after.
+    """
+    report = {"products": 0, "bytes_before": 0, "bytes_after": 0, "decode_ms_before": 0.0, "decode_ms_after": 0.0}
+    ops = []
+
+    for product in products.find({"bids.0": {"$exists": True}}):
+        top = sorted(product["bids"], key=lambda b: b.get("amount", 0), reverse=True)[:EMBEDDED_TOP_BIDS]
+        compacted = dict(product, bids=top)
+        compacted.setdefault("highest_bid", top[0].get("amount", 0))
+        compacted.setdefault("highest_bidder", top[0].get("user_id"))
+
+        before, after = bson.encode(product), bson.encode(compacted)
+        report["products"] += 1
+        report["bytes_before"] += len(before)
+        report["bytes_after"] += len(after)
+        report["decode_ms_before"] += _decode_ms(before)
+        report["decode_ms_after"] += _decode_ms(after)
+
+        ops.append(UpdateOne({"_id": product["_id"]}, {"$set": {
+            "bids": top,
+            "highest_bid": compacted["highest_bid"],
+            "highest_bidder": compacted["highest_bidder"]
+        }}))
+        if len(ops) >= batch_size and not dry_run:
+            products.bulk_write(ops, ordered=False)
+            ops = []
+
+    if ops and not dry_run:
+        products.bulk_write(ops, ordered=False)
+    return report
+
+
+def backfill_registrations(batch_size=1000):
+    """
+    Move embedded auctions.registrations arrays into the registrations
+    collection, then drop the arrays. Safe to re-run: duplicates are
+    rejected by the unique (auction_id, user_id) index.
+    """
+    failures = create_indexes(["registrations"])
+    if failures:
+        raise RuntimeError(failures["registrations"])
+    report = {"auctions": 0, "registrations": 0, "duplicates": 0}
+    now = datetime.utcnow()
+
+    for auction in auctions.find({"registrations.0": {"$exists": True}}, {"id": 1, "registrations": 1}):
+        user_ids = list(dict.fromkeys(str(r) for r in auction["registrations"]))
+        for i in range(0, len(user_ids), batch_size):
+            docs = [
+                {"auction_id": auction["id"], "user_id": user_id, "registered_at": now}
+                for user_id in user_ids[i:i + batch_size]
+            ]
+            try:
+                registrations.insert_many(docs, ordered=False)
+                report["registrations"] += len(docs)
+            except BulkWriteError as e:
+                dupes = sum(1 for err in e.details.get("writeErrors", []) if err.get("code") == 11000)
+                if dupes != len(e.details.get("writeErrors", [])):
+                    raise
+                report["registrations"] += len(docs) - dupes
+                report["duplicates"] += dupes
+
+        auctions.update_one({"_id": auction["_id"]}, {"$unset": {"registrations": ""}})
+        report["auctions"] += 1
+
+    auctions.update_many({"registrations": {"$size": 0}}, {"$unset": {"registrations": ""}})
+    return report
+
+
+def backfill_bid_counts(batch_size=500):
+    """
+    Give products without a bid_count one, without losing bids placed
+    while this runs.
+
+    Missing counts start at 0 first, from which point the bid path
+    increments them; the bids placed before that are then counted and
+    added with $inc rather than $set. Products are flagged while pending,
+    so a re-run after an interruption adds each count only once.
+    """
+    report = {"products": 0}
+    started = datetime.utcnow()
+    products.update_many(
+        {"bid_count": {"$exists": False}},
+        {"$set": {"bid_count": 0, "bid_count_pending": True}}
+    )
+    pending = [p["id"] for p in products.find({"bid_count_pending": True}, {"id": 1})]
+
+    for i in range(0, len(pending), batch_size):
+        chunk = pending[i:i + batch_size]
+        counts = {pid: 0 for pid in chunk}
+        for row in bids.aggregate([
+            {"$match": {
+                "product_id": {"$in": chunk},
+                "$or": [{"timestamp": {"$lt": started}}, {"timestamp": {"$exists": False}}]
+            }},
+            {"$group": {"_id": "$product_id", "count": {"$sum": 1}}}
+        ]):
+            counts[row["_id"]] = row["count"]
+        products.bulk_write([
+            UpdateOne(
+                {"id": pid, "bid_count_pending": True},
+                {"$inc": {"bid_count": count}, "$unset": {"bid_count_pending": ""}}
+            )
+            for pid, count in counts.items()
+        ], ordered=False)
+        report["products"] += len(chunk)
+    return report
+
+
+def convert_valid_until(batch_size=500, pause=0.1):
+    """
+    Online conversion of string valid_until values to native datetimes, in
+    batches. Each update is conditional on the string it read, so an admin
+    edit made mid-migration is never overwritten.
+    """
+    report = {"converted": 0, "unparseable": 0}
+    last_id = None
+    while True:
+        query = {"valid_until": {"$type": "string"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = list(auctions.find(query, {"valid_until": 1}).sort("_id", 1).limit(batch_size))
+        if not batch:
+            return report
+
+        ops = []
+        for auction in batch:
+            try:
+                deadline = parse_deadline(auction["valid_until"])
+            except ValueError:
+                report["unparseable"] += 1
+                continue
+            ops.append(UpdateOne(
+                {"_id": auction["_id"], "valid_until": auction["valid_until"]},
+                {"$set": {"valid_until": deadline}}
+            ))
+        if ops:
+            report["converted"] += auctions.bulk_write(ops, ordered=False).modified_count
+        last_id = batch[-1]["_id"]
+        time.sleep(pause)
+
+
+def check_links(repair=False, batch_size=500):
+    """
+    Compare auctions.product_ids with products.auction_id, which is the
+    authoritative side. Streams both collections once; with `repair`, stale
+    entries are pulled from auctions, missing ones added, and products
+    pointing at a deleted auction unlinked.
+    """
+    report = {"auctions": 0, "linked_products": 0, "stale_entries": 0, "missing_entries": 0, "orphaned_products": 0}
+    auction_ops, product_ops = [], []
+
+    def flush(force=False):
+        if auction_ops and (force or len(auction_ops) >= batch_size):
+            auctions.bulk_write(auction_ops, ordered=False)
+            auction_ops.clear()
+        if product_ops and (force or len(product_ops) >= batch_size):
+            products.bulk_write(product_ops, ordered=False)
+            product_ops.clear()
+
+    # 1) Entries an auction lists but whose product isn't linked back to it
+    for auction in auctions.find({}, {"id": 1, "product_ids": 1}):
+        report["auctions"] += 1
+        listed = auction.get("product_ids") or []
+        if not listed:
+            continue
+        linked = {
+            p["id"] for p in products.find({"id": {"$in": listed}, "auction_id": auction["id"]}, {"_id": 0, "id": 1})
+        }
+        stale = [pid for pid in listed if pid not in linked]
+        if stale:
+            report["stale_entries"] += len(stale)
+            print(f"auction {auction['id']}: lists unlinked products {stale[:10]}")
+            if repair:
+                auction_ops.append(UpdateOne({"_id": auction["_id"]}, {"$pull": {"product_ids": {"$in": stale}}}))
+                flush()
+
+    # 2) Products linked to an auction that doesn't list them, or no longer exists
+    linked_products = products.find({"auction_id": {"$ne": None}}, {"_id": 0, "id": 1, "auction_id": 1}).sort("auction_id", 1)
+    for auction_id, group in groupby(linked_products, key=lambda p: p["auction_id"]):
+        product_ids = [p["id"] for p in group]
+        report["linked_products"] += len(product_ids)
+        auction = auctions.find_one({"id": auction_id}, {"product_ids": 1})
+        if not auction:
+            report["orphaned_products"] += len(product_ids)
+            print(f"auction {auction_id}: missing, linked from products {product_ids[:10]}")
+            if repair:
+                product_ops.append(UpdateMany({"id": {"$in": product_ids}, "auction_id": auction_id}, {"$set": {"auction_id": None}}))
+                flush()
+            continue
+        listed = set(auction.get("product_ids") or [])
+        missing = [pid for pid in product_ids if pid not in listed]
+        if missing:
+            report["missing_entries"] += len(missing)
+            print(f"auction {auction_id}: doesn't list linked products {missing[:10]}")
+            if repair:
+                auction_ops.append(UpdateOne({"_id": auction["_id"]}, {"$addToSet": {"product_ids": {"$each": missing}}}))
+                flush()
+
+    if repair:
+        flush(force=True)
+    return report
+
+
+def drop_refunded_auctions():
+    """
+    Remove users.refunded_auctions, which refunds no longer read: each
+    refund is now deduplicated on its transaction's unique ref. Run once
+    no settlement from before that change is still in progress.
+    """
+    res = users.update_many({"refunded_auctions": {"$exists": True}}, {"$unset": {"refunded_auctions": ""}})
+    return {"users": res.modified_count}
+
+
+def _print_report(report):
+    for key, value in report.items():
+        print(f"{key}: {round(value, 3) if isinstance(value, float) else value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Auction data migrations")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    compact = sub.add_parser("compact-bids", help="Cap embedded product bids to the top N")
+    compact.add_argument("--dry-run", action="store_true", help="Only report sizes, don't write")
+    compact.add_argument("--batch-size", type=int, default=500)
+
+    backfill = sub.add_parser("backfill-registrations", help="Move embedded auction registrations to their own collection")
+    backfill.add_argument("--batch-size", type=int, default=1000)
+
+    counts = sub.add_parser("backfill-bid-counts", help="Denormalize bid counts onto products")
+    counts.add_argument("--batch-size", type=int, default=500)
+
+    convert = sub.add_parser("convert-valid-until", help="Store auctions.valid_until as native datetimes")
+    convert.add_argument("--batch-size", type=int, default=500)
+    convert.add_argument("--pause", type=float, default=0.1, help="Seconds to sleep between batches")
+
+    links = sub.add_parser("check-links", help="Report drift between auctions.product_ids and products.auction_id")
+    links.add_argument("--repair", action="store_true", help="Fix the drift, trusting products.auction_id")
+    links.add_argument("--batch-size", type=int, default=500)
+
+    sub.add_parser("drop-refunded-auctions", help="Remove the old per-user refund markers")
+
+    args = parser.parse_args()
+    if args.command == "compact-bids":
+        _print_report(compact_bids(dry_run=args.dry_run, batch_size=args.batch_size))
+    elif args.command == "backfill-registrations":
+        _print_report(backfill_registrations(batch_size=args.batch_size))
+    elif args.command == "backfill-bid-counts":
+        _print_report(backfill_bid_counts(batch_size=args.batch_size))
+    elif args.command == "convert-valid-until":
+        _print_report(convert_valid_until(batch_size=args.batch_size, pause=args.pause))
+    elif args.command == "check-links":
+        _print_report(check_links(repair=args.repair, batch_size=args.batch_size))
+    elif args.command == "drop-refunded-auctions":
+        _print_report(drop_refunded_auctions())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import threading
+import time
+from db import db
+
+products = db["products"]
+bids = db["bids"]
+
+# How many top bids each book keeps, and how long an entry is trusted before
+# it is checked against Mongo (another gunicorn worker may have accepted a
+# higher bid).
+BOOK_DEPTH = 5
+BOOK_MAX_AGE = 2.0
+
+
+class _Book:
+    __slots__ = ("lock", "top_bids", "loaded_at")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.top_bids = []
+        self.loaded_at = None
+
+
+class OrderBook:
+    """
+    In-process top-of-book per product.
+
+    Mongo stays the source of truth (the conditional claim in bidEngine);
+    the book answers highest-bid reads and bid pre-checks from memory.
+    A stale book is checked with a point read of the product's highest_bid
+    and only reloaded from bids when another worker has moved it.
+    """
+
+    def __init__(self, depth=BOOK_DEPTH, max_age=BOOK_MAX_AGE):
+        self.depth = depth
+        self.max_age = max_age
+        self._books = {}
+        self._books_lock = threading.Lock()
+
+    def _book(self, product_id):
+        book = self._books.get(product_id)
+        if book is None:
+            with self._books_lock:
+                book = self._books.setdefault(product_id, _Book())
+        return book
+
+    def lock(self, product_id):
+        """Per-product lock, so bids on different lots never contend."""
+        return self._book(product_id).lock
+
+    def _fresh(self, book):
+        return book.loaded_at is not None and time.monotonic() - book.loaded_at < self.max_age
+
+    def load(self, product_id, top_bids):
+        book = self._book(product_id)
+        book.top_bids = sorted(top_bids, key=lambda b: b.get("amount", 0), reverse=True)[:self.depth]
+        book.loaded_at = time.monotonic()
+
+    def _reload(self, product_id):
+        top = list(bids.find(
+            {"product_id": product_id},
+            {"_id": 0, "amount": 1, "user_id": 1, "timestamp": 1}
+        ).sort("amount", -1).limit(self.depth))
+        # The claimed highest bid is written synchronously, while the bid
+        # history may still be sitting in audit_writer's queue.
+        product = products.find_one({"id": product_id}, {"highest_bid": 1, "highest_bidder": 1}) or {}
+        highest = product.get("highest_bid")
+        if highest and (not top or highest > top[0].get("amount", 0)):
+            top.insert(0, {"amount": highest, "user_id": product.get("highest_bidder")})
+        self.load(product_id, top)
+
+    def _revalidate(self, product_id, book):
+        # Every accepted bid raises highest_bid, so an unchanged highest_bid
+        # means the whole book is still current.
+        product = products.find_one({"id": product_id}, {"_id": 0, "highest_bid": 1}) or {}
+        top = book.top_bids[0].get("amount", 0) if book.top_bids else 0
+        if (product.get("highest_bid") or 0) == top:
+            book.loaded_at = time.monotonic()
+        else:
+            self._reload(product_id)
+
+    def top_bids(self, product_id):
+        book = self._book(product_id)
+        if book.loaded_at is None:
+            self._reload(product_id)
+        elif not self._fresh(book):
+            self._revalidate(product_id, book)
+        return list(book.top_bids)
+
+    def highest(self, product_id):
+        top = self.top_bids(product_id)
+        return top[0].get("amount", 0) if top else 0
+
+    def record(self, product_id, bid):
+        """Apply an accepted bid to the in-memory book."""
+        book = self._book(product_id)
+        book.top_bids = sorted(
+            book.top_bids + [bid], key=lambda b: b.get("amount", 0), reverse=True
+        )[:self.depth]
+        book.loaded_at = time.monotonic()
+
+    def invalidate(self, product_id):
+        book = self._books.get(product_id)
+        if book is not None:
+            book.loaded_at = None
+
+    def rebuild(self):
+        """Load the books of every unsold product in an auction from Mongo."""
+        live = [p["id"] for p in products.find(
+            {"status": "unsold", "auction_id": {"$ne": None}}, {"id": 1}
+        )]
+        for product_id in live:
+            self.load(product_id, [])
+        pipeline = [
+            {"$match": {"product_id": {"$in": live}}},
+            {"$sort": {"product_id": 1, "amount": -1}},
+            {"$group": {
+                "_id": "$product_id",
+                "top": {"$push": {"amount": "$amount", "user_id": "$user_id", "timestamp": "$timestamp"}}
+            }},
+            {"$project": {"top": {"$slice": ["$top", self.depth]}}}
+        ]
+        for row in bids.aggregate(pipeline, allowDiskUse=True):
+            self.load(row["_id"], row["top"])
+        return len(live)
+
+
+order_book = OrderBook()
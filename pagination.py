@@ -0,0 +1,55 @@
+import base64
+import json
+from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Newest first; _id breaks ties between records with the same timestamp.
+KEYSET_SORT = [("timestamp", -1), ("_id", -1)]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(doc):
+    raw = json.dumps({"t": doc["timestamp"].isoformat(), "i": str(doc["_id"])})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(token):
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+        return datetime.fromisoformat(raw["t"]), ObjectId(raw["i"])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise InvalidCursor("Invalid cursor")
+
+
+def page_args(args):
+    """Read `limit` and `after` from the query string."""
+    try:
+        limit = int(args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise InvalidCursor("limit must be an integer")
+    return min(max(limit, 1), MAX_PAGE_SIZE), args.get("after")
+
+
+def keyset_page(collection, query, projection, limit, after=None):
+    """
+    One page of `query`, newest first, starting after the opaque `after`
+    cursor. Returns (docs, next_cursor); next_cursor is None on the last page.
+    """
+    if after:
+        ts, oid = decode_cursor(after)
+        query = {"$and": [query, {"$or": [
+            {"timestamp": {"$lt": ts}},
+            {"timestamp": ts, "_id": {"$lt": oid}}
+        ]}]}
+
+    projection = dict(projection, timestamp=1, _id=1)
+    docs = list(collection.find(query, projection).sort(KEYSET_SORT).limit(limit + 1))
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
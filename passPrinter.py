@@ -1,5 +1,6 @@
 import bcrypt
+from passwords import configured_rounds
 
 password = "anuj"
-hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-print(hashed.decode())  # ⬅️ Save this string into MongoDB
\ No newline at end of file
+hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=configured_rounds()))
+print(hashed.decode())  # ⬅️ Save this string into MongoDB
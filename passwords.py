@@ -0,0 +1,271 @@
+"""
+bcrypt hashing off the request threads, with a cost factor tuned to this host.
+
+    python passwords.py calibrate [--target-ms MS]   # pick BCRYPT_ROUNDS for this host
+    python passwords.py hash PASSWORD                # hash with the configured cost
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+from filelock import FileLock, Timeout
+
+# bcrypt holds a core for ~250 ms per call; keep it off the request threads.
+# Both budgets cover the whole host, however many gunicorn workers share it:
+# at most POOL_SIZE hashes run at once, and at most MAX_PENDING are running
+# or waiting before logins are shed.
+POOL_SIZE = int(os.getenv("BCRYPT_WORKERS", str(os.cpu_count() or 1)))
+MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", str(POOL_SIZE * 4)))
+# Lock files backing the host-wide slots.
+SLOT_DIR = os.getenv("BCRYPT_SLOT_DIR", os.path.join(tempfile.gettempdir(), "auction-bcrypt-slots"))
+# An admitted call gives up if no hashing slot frees up within this long.
+SLOT_WAIT_SECONDS = 5.0
+SLOT_POLL_SECONDS = 0.01
+RETRY_AFTER_SECONDS = 1
+
+# Cost is calibrated to take about TARGET_MS per hash unless BCRYPT_ROUNDS pins it.
+# Stored hashes are only migrated to a pinned cost: each worker calibrates on its
+# own, and hosts or workers measuring differently would rehash each other's passwords.
+TARGET_MS = float(os.getenv("BCRYPT_TARGET_MS", "250"))
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+
+class PasswordPoolBusy(Exception):
+    """Raised instead of queueing when the hashing pool is saturated."""
+
+    retry_after = RETRY_AFTER_SECONDS
+
+
+class HostSlots:
+    """
+    A counting semaphore shared by every process on the host: `count` lock
+    files, each held by at most one caller. The OS drops a lock when its
+    holder dies, so a crashed worker never leaks a slot.
+    """
+
+    def __init__(self, name, count, directory=SLOT_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.count = count
+        self._locks = [FileLock(os.path.join(directory, f"{name}-{i}.lock")) for i in range(count)]
+
+    def try_acquire(self):
+        """A held slot (release() it when done), or None if all are taken."""
+        start = random.randrange(self.count)
+        for i in range(self.count):
+            lock = self._locks[(start + i) % self.count]
+            if lock.is_locked:
+                continue  # held by this thread already; FileLock would re-enter it
+            try:
+                lock.acquire(timeout=0)
+                return lock
+            except Timeout:
+                continue
+        return None
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            slot = self.try_acquire()
+            if slot is not None or time.monotonic() >= deadline:
+                return slot
+            time.sleep(SLOT_POLL_SECONDS)
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _check(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+def measure_ms(rounds, samples=3):
+    """Fastest of `samples` hashes at `rounds`, in milliseconds."""
+    best = None
+    for _ in range(samples):
+        started = time.perf_counter()
+        bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds=rounds))
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate(target_ms=TARGET_MS):
+    """Highest cost whose hash time stays within `target_ms` (each step doubles it)."""
+    rounds = MIN_ROUNDS
+    cost_ms = measure_ms(rounds)
+    while rounds < MAX_ROUNDS and cost_ms * 2 <= target_ms:
+        rounds += 1
+        cost_ms *= 2
+    return rounds
+
+
+def pinned_rounds():
+    """BCRYPT_ROUNDS, clamped to what bcrypt accepts, or None if unset."""
+    pinned = os.getenv("BCRYPT_ROUNDS")
+    if pinned:
+        return min(max(int(pinned), 4), 31)
+    return None
+
+
+def configured_rounds():
+    pinned = pinned_rounds()
+    return pinned if pinned is not None else calibrate()
+
+
+def stored_rounds(hashed):
+    """Cost factor of a stored "$2b$12$..." hash, or None if it isn't one."""
+    try:
+        return int(hashed.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt in a process pool under host-wide limits: a call first takes
+    one of `max_pending` admission slots, or gets PasswordPoolBusy at once
+    rather than waiting behind the queue, then waits for one of `workers`
+    hashing slots. Whatever the number of gunicorn workers, no more than
+    `workers` hashes run on the host at a time.
+
+    Pool processes are started on demand, so a worker only runs as many as
+    it hashes concurrently, and they come from a forkserver rather than
+    forking this process, which already runs Mongo, scheduler and
+    job-runner threads.
+    """
+
+    def __init__(self, workers=POOL_SIZE, max_pending=MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._admission = HostSlots("pending", max_pending)
+        self._cores = HostSlots("running", workers)
+        self._pool = None
+        self._pool_pid = None
+        self._rounds = None
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "rejected": 0, "in_flight": 0, "running": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+    @property
+    def rounds(self):
+        """Cost factor for new hashes, calibrated on first use."""
+        if self._rounds is None:
+            with self._lock:
+                if self._rounds is None:
+                    self._rounds = configured_rounds()
+        return self._rounds
+
+    def needs_rehash(self, hashed):
+        """True if BCRYPT_ROUNDS is pinned and `hashed` was made at another cost."""
+        pinned = pinned_rounds()
+        return pinned is not None and stored_rounds(hashed) != pinned
+
+    def _executor(self):
+        # A pool inherited across a gunicorn fork belongs to the parent
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                context = multiprocessing.get_context("forkserver")
+                # The server only needs bcrypt, not the app's __main__
+                context.set_forkserver_preload(["passwords"])
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _reset(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+
+    def _reject(self):
+        with self._lock:
+            self._stats["rejected"] += 1
+        raise PasswordPoolBusy()
+
+    def _run(self, fn, *args):
+        admitted = self._admission.try_acquire()
+        if admitted is None:
+            self._reject()
+        with self._lock:
+            self._stats["in_flight"] += 1
+        started = time.perf_counter()
+        try:
+            core = self._cores.acquire(SLOT_WAIT_SECONDS)
+            if core is None:
+                self._reject()
+            with self._lock:
+                self._stats["running"] += 1
+            pool = self._executor()
+            try:
+                return pool.submit(fn, *args).result()
+            except BrokenProcessPool:
+                self._reset(pool)
+                raise
+            finally:
+                core.release()
+                with self._lock:
+                    self._stats["running"] -= 1
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            admitted.release()
+            with self._lock:
+                s = self._stats
+                s["in_flight"] -= 1
+                s["calls"] += 1
+                s["total_ms"] += elapsed_ms
+                s["max_ms"] = max(s["max_ms"], elapsed_ms)
+
+    def hash(self, password):
+        """bcrypt hash of `password` as a str, ready to store."""
+        return self._run(_hash, password.encode("utf-8"), self.rounds).decode("utf-8")
+
+    def check(self, password, hashed):
+        return self._run(_check, password.encode("utf-8"), hashed.encode("utf-8"))
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        return {
+            "rounds": self._rounds,
+            "workers": self.workers,
+            "capacity": self.max_pending,
+            "in_flight": s["in_flight"],
+            "queued": s["in_flight"] - s["running"],
+            "calls": s["calls"],
+            "rejected": s["rejected"],
+            "avg_ms": round(s["total_ms"] / s["calls"], 2) if s["calls"] else 0.0,
+            "max_ms": round(s["max_ms"], 2)
+        }
+
+
+password_hasher = PasswordHasher()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bcrypt cost tuning")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cal = sub.add_parser("calibrate", help="Benchmark this host and suggest BCRYPT_ROUNDS")
+    cal.add_argument("--target-ms", type=float, default=TARGET_MS)
+    hsh = sub.add_parser("hash", help="Hash a password with the configured cost")
+    hsh.add_argument("password")
+
+    args = parser.parse_args()
+    if args.command == "calibrate":
+        for rounds in range(MIN_ROUNDS, MAX_ROUNDS + 1):
+            cost_ms = measure_ms(rounds, samples=1)
+            print(f"rounds {rounds}: {cost_ms:.1f} ms")
+            if cost_ms > args.target_ms:
+                break
+        print(f"BCRYPT_ROUNDS={calibrate(args.target_ms)}")
+    else:
+        print(bcrypt.hashpw(args.password.encode("utf-8"), bcrypt.gensalt(rounds=configured_rounds())).decode("utf-8"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import csv
+import io
+import json
+from pymongo.errors import BulkWriteError
+from bidEngine import empty_bid_fields
+from db import db
+
+products = db["products"]
+
+REQUIRED_FIELDS = ("id", "name", "description")
+CHUNK_SIZE = 500
+# Only the first errors are echoed back; the rest are counted.
+MAX_REPORTED_ERRORS = 100
+
+
+class UnsupportedFormat(ValueError):
+    pass
+
+
+def _ndjson_rows(text):
+    for line in text:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield None, "Invalid JSON"
+            continue
+        if not isinstance(row, dict):
+            yield None, "Row must be a JSON object"
+            continue
+        yield row, None
+
+
+def _csv_rows(text):
+    for row in csv.DictReader(text):
+        yield row, None
+
+
+def iter_rows(stream, content_type):
+    """
+    Yield (row, error) for every record of an NDJSON or CSV byte stream,
+    reading it line by line so the body is never held in memory.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8", errors="replace", newline="")
+    mimetype = (content_type or "").split(";")[0].strip().lower()
+    if mimetype in ("application/x-ndjson", "application/jsonl", "application/ndjson"):
+        return _ndjson_rows(text)
+    if mimetype in ("text/csv", "application/csv"):
+        return _csv_rows(text)
+    raise UnsupportedFormat("Content-Type must be application/x-ndjson or text/csv")
+
+
+def _product(row, admin_id):
+    for f in REQUIRED_FIELDS:
+        value = row.get(f)
+        if value is None or (isinstance(value, str) and not value.strip()):
+            raise ValueError(f"{f} required")
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "description": row["description"],
+        "auction_id": None,
+        "sold_to": None,
+        "admin_id": admin_id,
+        "status": "unsold",
+        "bids": [],
+        **empty_bid_fields()
+    }
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, row_number, product_id, message):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row_number, "id": product_id, "error": message})
+
+    def to_dict(self):
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors)
+        }
+
+
+def _write_chunk(chunk, report):
+    """chunk is a list of (row_number, product)."""
+    try:
+        products.insert_many([doc for _, doc in chunk], ordered=False)
+        report.inserted += len(chunk)
+    except BulkWriteError as e:
+        write_errors = e.details.get("writeErrors", [])
+        report.inserted += e.details.get("nInserted", len(chunk) - len(write_errors))
+        for err in write_errors:
+            row_number, doc = chunk[err["index"]]
+            message = "Product id already exists" if err.get("code") == 11000 else err.get("errmsg", "Write failed")
+            report.error(row_number, doc["id"], message)
+
+
+def import_products(rows, admin_id, chunk_size=CHUNK_SIZE):
+    """
+    Validate `rows` as they arrive and insert them in unordered chunks.
+    A bad or duplicate row is reported by its 1-based row number and does
+    not stop the import.
+    """
+    report = ImportReport()
+    chunk = []
+    for row_number, (row, error) in enumerate(rows, start=1):
+        report.rows += 1
+        if error is None:
+            try:
+                chunk.append((row_number, _product(row, admin_id)))
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            report.error(row_number, row.get("id") if row else None, error)
+        if len(chunk) >= chunk_size:
+            _write_chunk(chunk, report)
+            chunk = []
+    if chunk:
+        _write_chunk(chunk, report)
+    return report.to_dict()
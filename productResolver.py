@@ -0,0 +1,57 @@
+from cache import TTLCache
+from db import db
+
+products = db["products"]
+
+# Only the fields the request paths need; bids and descriptions stay in Mongo.
+PRODUCT_FIELDS = {"_id": 1, "id": 1, "name": 1, "auction_id": 1, "status": 1}
+
+
+def product_lookup_query(product_key):
+    """The product may be addressed by string id, int id or name."""
+    try:
+        product_id = int(product_key)
+    except (ValueError, TypeError):
+        product_id = None
+
+    return {
+        "$or": [
+            {"id": str(product_key)},
+            {"id": product_id},
+            {"name": product_key}
+        ]
+    }
+
+
+class ProductResolver:
+    """
+    Resolves a product key to its product, caching the result under the
+    key that was asked for as well as the product's id and name.
+
+    Admin write paths call invalidate(); the TTL bounds how stale other
+    gunicorn workers can be.
+    """
+
+    def __init__(self, maxsize=4096, ttl=15.0):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def resolve(self, product_key):
+        key = str(product_key)
+        product = self._cache.get(key)
+        if product is None:
+            product = products.find_one(product_lookup_query(product_key), PRODUCT_FIELDS)
+            if not product:
+                return None
+            for k in (key, str(product.get("id")), product.get("name")):
+                if k is not None:
+                    self._cache.set(str(k), product)
+        return dict(product)
+
+    def invalidate(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+product_resolver = ProductResolver()
@@ -0,0 +1,210 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from flask import request
+from flask_limiter import HEADERS, Limiter
+from flask_limiter.util import get_remote_address
+from limits.storage import MovingWindowSupport, Storage
+from tokenCheck import verify_token
+
+# Limits are "N/period" strings, ";"-separated; a short and a long window
+# together give a burst allowance plus a sustained rate.
+LOGIN_LIMIT = os.getenv("LOGIN_RATE_LIMIT", "5/minute;30/hour")
+LOGIN_IP_LIMIT = os.getenv("LOGIN_IP_RATE_LIMIT", "30/minute")
+REGISTER_LIMIT = os.getenv("REGISTER_RATE_LIMIT", "10/hour")
+BID_LIMIT = os.getenv("BID_RATE_LIMIT", "5/second;120/minute")
+# Per client IP across every bidder it names; a voice-agent server bids for
+# many users from one address, so this is far looser than BID_LIMIT.
+BID_IP_LIMIT = os.getenv("BID_IP_RATE_LIMIT", "50/second;1200/minute")
+
+STORAGE_URI = os.getenv(
+    "RATELIMIT_STORAGE_URI",
+    f"sqlite:///{os.path.join(tempfile.gettempdir(), 'auction-ratelimits.sqlite3')}"
+)
+
+
+class SQLiteStorage(Storage, MovingWindowSupport):
+    """
+    Limits in a local SQLite file, so every gunicorn worker on the host
+    shares them. Moving windows keep one row per hit, counted and added in
+    a single write transaction; fixed-window counters are atomic upserts.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    # Expired rows are purged on roughly one increment in this many.
+    PURGE_EVERY = 1000
+
+    def __init__(self, uri, wrap_exceptions=False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        # sqlite:///relative/path or sqlite:////absolute/path, as in SQLAlchemy
+        self.path = uri.split("://", 1)[1][1:]
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters "
+                "(key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries "
+                "(key TEXT NOT NULL, at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_key_at ON entries (key, at)")
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            "INSERT INTO counters (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET "
+            "value = CASE WHEN expires_at <= ? THEN excluded.value ELSE value + excluded.value END, "
+            "expires_at = CASE WHEN expires_at <= ? OR ? THEN excluded.expires_at ELSE expires_at END "
+            "RETURNING value",
+            (key, amount, now + expiry, now, now, int(elastic_expiry))
+        ).fetchone()
+        if random.randrange(self.PURGE_EVERY) == 0:
+            conn.execute("DELETE FROM counters WHERE expires_at <= ?", (now,))
+        return row[0]
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM counters WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        row = self._conn().execute("SELECT expires_at FROM counters WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        return row[0] if row and row[0] > now else now
+
+    def acquire_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            (count,) = conn.execute(
+                "SELECT COUNT(*) FROM entries WHERE key = ? AND at > ?", (key, now - expiry)
+            ).fetchone()
+            if count + amount > limit:
+                conn.execute("ROLLBACK")
+                return False
+            conn.executemany(
+                "INSERT INTO entries (key, at, expires_at) VALUES (?, ?, ?)",
+                [(key, now, now + expiry)] * amount
+            )
+            if random.randrange(self.PURGE_EVERY) == 0:
+                conn.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            conn.execute("COMMIT")
+            return True
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_moving_window(self, key, limit, expiry):
+        now = time.time()
+        start, count = self._conn().execute(
+            "SELECT MIN(at), COUNT(*) FROM entries WHERE key = ? AND at > ?", (key, now - expiry)
+        ).fetchone()
+        return (start if start is not None else now), count
+
+    def check(self):
+        try:
+            self._conn().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        conn = self._conn()
+        return conn.execute("DELETE FROM counters").rowcount + conn.execute("DELETE FROM entries").rowcount
+
+    def clear(self, key):
+        conn = self._conn()
+        conn.execute("DELETE FROM counters WHERE key = ?", (key,))
+        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+
+def client_ip():
+    return f"ip:{get_remote_address()}"
+
+
+def _body_username():
+    # /bid names the bidder in user_id, the auth routes in username
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        for field in ("username", "user_id"):
+            if isinstance(data.get(field), str) and data[field]:
+                return data[field]
+    return None
+
+
+def _token_username():
+    auth_header = request.headers.get("Authorization", "")
+    token = auth_header.split(" ")[1] if auth_header.startswith("Bearer ") else None
+    token = token or request.cookies.get("admin_token") or request.cookies.get("token")
+    if token:
+        try:
+            return verify_token(token).get("username")
+        except Exception:
+            pass
+    return None
+
+
+def rate_limit_key():
+    """The caller's username from a valid JWT, else their IP."""
+    username = _token_username()
+    return f"user:{username}" if username else client_ip()
+
+
+def login_key():
+    """
+    The account being signed in to, from this IP. Anyone can name any
+    account, so guesses from elsewhere never lock its owner out;
+    LOGIN_IP_LIMIT caps what one IP tries across accounts.
+    """
+    username = _body_username()
+    return f"login:{username}@{get_remote_address()}" if username else client_ip()
+
+
+def bid_key():
+    """
+    A bidder verified by JWT, else the bidder named in the body from this
+    IP, so junk bids naming a rival only fill the sender's own bucket.
+    """
+    username = _token_username()
+    if username:
+        return f"user:{username}"
+    username = _body_username()
+    return f"bid:{username}@{get_remote_address()}" if username else client_ip()
+
+
+limiter = Limiter(
+    key_func=rate_limit_key,
+    storage_uri=STORAGE_URI,
+    strategy="moving-window",
+    headers_enabled=True,
+    # Limited routes answer 503s of their own (bcrypt pool) with a short
+    # Retry-After; only the 429 handler sets it from the breached limit.
+    header_name_mapping={HEADERS.RETRY_AFTER: "X-RateLimit-Retry-After"},
+    # A broken limiter store must not take the API down with it
+    swallow_errors=True,
+    in_memory_fallback_enabled=True
+)
@@ -0,0 +1,357 @@
+"""
+Auction settlement.
+
+Run as a script to settle every expired auction with a pool of workers;
+several copies can run on different hosts, each auction is claimed through
+a lease on its document:
+
+    python settlement.py [--workers N] [--every SECONDS]
+"""
+import argparse
+import logging
+import os
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from db import db
+from auditWriter import audit_writer
+from productResolver import product_resolver
+from auctionClock import ended_auctions_query, parse_deadline
+
+products = db["products"]
+auctions = db["auctions"]
+bids = db["bids"]
+users = db["users"]
+transactions = db["transactions"]
+
+log = logging.getLogger(__name__)
+
+# A crashed worker's claim is taken over once its lease runs out.
+LEASE_SECONDS = 120
+# A bid that passed the deadline check just before valid_until may still be
+# claiming its lot; settlement reads winners no sooner than this after it.
+GRACE_SECONDS = 2.0
+# Prefix of every lease token this process hands out, to tell holders apart in the data.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def winning_bids(product_ids):
+    """
+    {product_id: winning bid or None} for every product that exists.
+
+    The winner is the product's highest_bid/highest_bidder, set by the
+    atomic claim when the bid was accepted; the bids collection is written
+    through the group-commit writer and may be missing that record. Only
+    products from before the denormalized fields fall back to their top
+    stored bid.
+    """
+    winners = {}
+    legacy = []
+    for product in products.find(
+        {"id": {"$in": product_ids}},
+        {"_id": 0, "id": 1, "highest_bid": 1, "highest_bidder": 1}
+    ):
+        if "highest_bid" not in product:
+            legacy.append(product["id"])
+        elif product.get("highest_bidder"):
+            winners[product["id"]] = {"user_id": product["highest_bidder"], "amount": product["highest_bid"]}
+        else:
+            winners[product["id"]] = None
+
+    if legacy:
+        for product_id in legacy:
+            winners[product_id] = None
+        for row in bids.aggregate([
+            {"$match": {"product_id": {"$in": legacy}}},
+            {"$sort": {"product_id": 1, "amount": -1}},
+            {"$group": {"_id": "$product_id", "user_id": {"$first": "$user_id"}, "amount": {"$first": "$amount"}}}
+        ]):
+            winners[row["_id"]] = {"user_id": row["user_id"], "amount": row["amount"]}
+    return winners
+
+
+def _winning_bid_ids(winners):
+    """
+    _ids of the bid records behind each product's winning bid. A winning bid
+    whose record never reached `bids` has nothing to exclude, so the winner's
+    other bids are still all refunded.
+    """
+    clauses = [
+        {"product_id": product_id, "user_id": w["user_id"], "amount": w["amount"]}
+        for product_id, w in winners.items() if w
+    ]
+    if not clauses:
+        return []
+    winning_ids = {}
+    for bid in bids.find({"$or": clauses}, {"product_id": 1}):
+        winning_ids.setdefault(bid["product_id"], bid["_id"])
+    return list(winning_ids.values())
+
+
+def refund_losing_bids(auction_id, winners):
+    """
+    Credit every bid placed in the auction except the winning ones back to
+    its bidder: one aggregation for per-user totals, then one bulk write per
+    step. Returns what this call credited.
+
+    Safe to re-run: each bidder's refund is a transaction with the unique
+    ref refund:<auction>:<user>, recorded "pending" before the user is
+    credited and marked "applied" after. The credit pushes the ref onto the
+    user's pending_refunds and only matches while it is missing; the ref is
+    pulled again once the record is applied, so the array only ever holds
+    refunds in progress.
+    """
+    winning_ids = _winning_bid_ids(winners)
+    totals = list(bids.aggregate([
+        {"$match": {"auction_id": auction_id, "_id": {"$nin": winning_ids}}},
+        {"$group": {"_id": "$user_id", "amount": {"$sum": "$amount"}, "bids": {"$sum": 1}}}
+    ]))
+    credited = {"users": 0, "bids": 0, "amount": 0}
+    if not totals:
+        return credited
+
+    refs = [f"refund:{auction_id}:{t['_id']}" for t in totals]
+    usernames = [t["_id"] for t in totals]
+    now = datetime.utcnow()
+    try:
+        transactions.insert_many([
+            {
+                "ref": ref,
+                "username": t["_id"],
+                "type": "refund",
+                "amount": t["amount"],
+                "timestamp": now,
+                "status": "pending",
+                "meta": {
+                    "auction_id": auction_id,
+                    "bids": t["bids"],
+                    "notes": f"Refund of {t['bids']} outbid bids in auction {auction_id}"
+                }
+            }
+            for ref, t in zip(refs, totals)
+        ], ordered=False)
+    except BulkWriteError as e:
+        # Duplicates are refunds recorded by an earlier, interrupted run
+        if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+            raise
+
+    # Pending records include those an interrupted run never finished;
+    # users already holding the ref were credited before it stopped.
+    pending = list(transactions.find(
+        {"ref": {"$in": refs}, "status": "pending"},
+        {"ref": 1, "username": 1, "amount": 1, "meta.bids": 1}
+    ))
+    if pending:
+        in_progress = {u["username"] for u in users.find(
+            {"username": {"$in": [r["username"] for r in pending]}, "pending_refunds": {"$in": refs}},
+            {"username": 1}
+        )}
+        to_credit = [r for r in pending if r["username"] not in in_progress]
+        if to_credit:
+            res = users.bulk_write([
+                UpdateOne(
+                    {"username": r["username"], "pending_refunds": {"$ne": r["ref"]}},
+                    {"$inc": {"wallet_balance": r["amount"]}, "$push": {"pending_refunds": r["ref"]}}
+                )
+                for r in to_credit
+            ], ordered=False)
+            if res.modified_count < len(to_credit):
+                # Bidders whose accounts are gone weren't credited
+                found = {u["username"] for u in users.find(
+                    {"username": {"$in": [r["username"] for r in to_credit]}}, {"username": 1}
+                )}
+                to_credit = [r for r in to_credit if r["username"] in found]
+            credited["users"] = res.modified_count
+            credited["bids"] = sum(r.get("meta", {}).get("bids", 0) for r in to_credit)
+            credited["amount"] = sum(r["amount"] for r in to_credit)
+        transactions.update_many(
+            {"ref": {"$in": [r["ref"] for r in pending]}, "status": "pending"},
+            {"$set": {"status": "applied"}}
+        )
+
+    users.update_many(
+        {"username": {"$in": usernames}, "pending_refunds": {"$in": refs}},
+        {"$pull": {"pending_refunds": {"$in": refs}}}
+    )
+    bids.update_many(
+        {"auction_id": auction_id, "_id": {"$nin": winning_ids}},
+        {"$set": {"status": "refunded"}}
+    )
+    return credited
+
+
+def settle(auction, owner):
+    """
+    Mark every product of `auction` sold to its highest bidder (or unsold)
+    with one bulk_write, refund the outbid bids, then flag the auction
+    settled. Returns the report the settle endpoint sends back.
+
+    `owner` is the token claim() returned the lease under. It is renewed between phases
+    and the auction is only flagged settled while `owner` still holds it;
+    LeaseLost is raised otherwise, leaving the rest to the new holder.
+    """
+    product_ids = auction["product_ids"]
+
+    # Close the lots first: from here on no bid can claim them, so the
+    # winners read below are final
+    products.update_many(
+        {"id": {"$in": product_ids}, "auction_id": auction["id"]},
+        {"$set": {"closed_auction_id": auction["id"]}}
+    )
+    try:
+        remaining = (parse_deadline(auction["valid_until"]) - datetime.utcnow()).total_seconds() + GRACE_SECONDS
+    except (KeyError, ValueError):
+        remaining = 0
+    if remaining > 0:
+        time.sleep(remaining)
+
+    # Bids accepted by this worker may still be queued
+    audit_writer.flush()
+
+    winners = winning_bids(product_ids)
+
+    missing_products = []
+    settled_products = []
+    ops = []
+
+    for product_id in product_ids:
+        if product_id not in winners:
+            missing_products.append(product_id)
+            continue
+
+        winning = winners[product_id]
+        if winning:
+            result = {"product_id": product_id, "status": "sold", "sold_to": winning["user_id"]}
+        else:
+            result = {"product_id": product_id, "status": "unsold", "sold_to": None}
+        ops.append(UpdateOne({"id": product_id}, {"$set": {"status": result["status"], "sold_to": result["sold_to"]}}))
+        settled_products.append(result)
+
+    renew(auction["id"], owner)
+    if ops:
+        products.bulk_write(ops, ordered=False)
+    product_resolver.invalidate()
+
+    renew(auction["id"], owner)
+    refunds = refund_losing_bids(auction["id"], winners)
+
+    res = auctions.update_one(
+        {"id": auction["id"], "settle_lease_owner": owner},
+        {
+            "$set": {"settled": True, "settled_at": datetime.utcnow()},
+            "$unset": {"settle_lease_owner": "", "settle_lease_expires_at": ""}
+        }
+    )
+    if res.matched_count == 0:
+        raise LeaseLost()
+
+    return {
+        "settled_products": settled_products,
+        "missing_products": missing_products,
+        "winning_bids": winners,
+        "refunds": refunds
+    }
+
+
+def claim(auction_id, lease_seconds=LEASE_SECONDS, extra_filter=None):
+    """
+    Atomically take the settlement lease on an unsettled auction. Succeeds
+    when nobody holds it or the holder's lease has expired. Returns the
+    claimed auction, or None; its settle_lease_owner is a token unique to
+    this claim, for settle(), renew() and release().
+    """
+    now = datetime.utcnow()
+    owner = f"{WORKER_ID}:{uuid.uuid4().hex}"
+    query = {
+        "id": auction_id,
+        "settled": {"$ne": True},
+        "$or": [
+            {"settle_lease_expires_at": None},
+            {"settle_lease_expires_at": {"$lte": now}}
+        ]
+    }
+    if extra_filter:
+        query = {"$and": [query, extra_filter]}
+    return auctions.find_one_and_update(
+        query,
+        {"$set": {
+            "settle_lease_owner": owner,
+            "settle_lease_expires_at": now + timedelta(seconds=lease_seconds)
+        }},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def renew(auction_id, owner, lease_seconds=LEASE_SECONDS):
+    """Extend `owner`'s settlement lease, or raise LeaseLost if it has been taken over."""
+    res = auctions.update_one(
+        {"id": auction_id, "settled": {"$ne": True}, "settle_lease_owner": owner},
+        {"$set": {"settle_lease_expires_at": datetime.utcnow() + timedelta(seconds=lease_seconds)}}
+    )
+    if res.matched_count == 0:
+        raise LeaseLost()
+
+
+def release(auction_id, owner):
+    auctions.update_one(
+        {"id": auction_id, "settle_lease_owner": owner},
+        {"$unset": {"settle_lease_owner": "", "settle_lease_expires_at": ""}}
+    )
+
+
+def settle_claimed(auction_id):
+    """Claim and settle an expired auction. None if it wasn't ours to settle."""
+    auction = claim(auction_id, extra_filter=ended_auctions_query())
+    if not auction:
+        return None
+    owner = auction["settle_lease_owner"]
+    try:
+        if not isinstance(auction.get("product_ids"), list):
+            auction["product_ids"] = []
+        return settle(auction, owner)
+    except Exception:
+        release(auction_id, owner)
+        raise
+
+
+def settle_expired(workers=4):
+    """Settle every expired, unsettled auction in parallel. Returns how many this process settled."""
+    query = {"settled": {"$ne": True}}
+    query.update(ended_auctions_query())
+    expired = [a["id"] for a in auctions.find(query, {"id": 1})]
+
+    def run(auction_id):
+        try:
+            return settle_claimed(auction_id) is not None
+        except Exception as e:
+            log.error(f"Settlement of auction {auction_id} failed: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(run, expired))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Settle expired auctions")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--every", type=float, default=0, help="Repeat every N seconds instead of running once")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    while True:
+        log.info(f"{WORKER_ID} settled {settle_expired(workers=args.workers)} auctions")
+        if not args.every:
+            return
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from db import db
+from auctionClock import parse_deadline
+from settlement import settle_claimed
+
+auctions = db["auctions"]
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.getenv("SETTLEMENT_SCHEDULER", "on").lower() not in ("0", "off", "false")
+
+# Upper bound on a single wait, so clock adjustments can't strand the thread.
+MAX_WAIT_SECONDS = 60.0
+RETRY_SECONDS = 30
+# Auctions closing together are settled in parallel.
+SETTLE_WORKERS = int(os.getenv("SETTLEMENT_WORKERS", "4"))
+
+
+class SettlementScheduler:
+    """
+    Settles auctions as their valid_until passes.
+
+    Deadlines sit in a min-heap; the thread sleeps until the earliest one
+    instead of polling the collection. Entries are (deadline, seq,
+    auction_id): the sequence number breaks ties, so auction ids of mixed
+    types are never compared. Rescheduling pushes a new heap entry and the
+    superseded one is skipped when it surfaces. Every worker runs
+    one; the settlement lease makes sure only one of them settles a given
+    auction.
+    """
+
+    def __init__(self, workers=SETTLE_WORKERS):
+        self._heap = []
+        # auction_id -> seq of its live heap entry
+        self._entries = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="settle")
+
+    def start(self):
+        """Start the scheduler thread and load every unsettled auction."""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="settlement-scheduler", daemon=True)
+            self._thread.start()
+        count = 0
+        for auction in auctions.find({"settled": {"$ne": True}}, {"id": 1, "valid_until": 1}):
+            try:
+                self.schedule(auction["id"], parse_deadline(auction.get("valid_until")))
+                count += 1
+            except ValueError:
+                log.error(f"Auction {auction['id']} has an invalid valid_until, not scheduling")
+        return count
+
+    def schedule(self, auction_id, deadline):
+        with self._cond:
+            seq = next(self._seq)
+            self._entries[auction_id] = seq
+            heapq.heappush(self._heap, (deadline, seq, auction_id))
+            self._cond.notify()
+
+    def cancel(self, auction_id):
+        with self._cond:
+            self._entries.pop(auction_id, None)
+            self._cond.notify()
+
+    def _next_due(self):
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, seq, auction_id = self._heap[0]
+                if self._entries.get(auction_id) != seq:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = (deadline - datetime.utcnow()).total_seconds()
+                if delay > 0:
+                    self._cond.wait(min(delay, MAX_WAIT_SECONDS))
+                    continue
+                heapq.heappop(self._heap)
+                del self._entries[auction_id]
+                return auction_id
+
+    def _settle(self, auction_id):
+        fields = {"valid_until": 1, "settled": 1, "settle_lease_expires_at": 1}
+        auction = auctions.find_one({"id": auction_id}, fields)
+        if not auction or auction.get("settled", False):
+            return
+        # Another worker may have moved the deadline since it was scheduled here
+        deadline = parse_deadline(auction.get("valid_until"))
+        if datetime.utcnow() < deadline:
+            self.schedule(auction_id, deadline)
+            return
+
+        report = settle_claimed(auction_id)
+        if report is not None:
+            log.info(f"Settled auction {auction_id}: {len(report['settled_products'])} products")
+            return
+
+        # Someone else holds the lease; look again when it runs out in case they crashed
+        auction = auctions.find_one({"id": auction_id}, fields)
+        if auction and not auction.get("settled", False) and auction.get("settle_lease_expires_at"):
+            self.schedule(auction_id, auction["settle_lease_expires_at"] + timedelta(seconds=1))
+
+    def _settle_or_retry(self, auction_id):
+        try:
+            self._settle(auction_id)
+        except Exception as e:
+            log.error(f"Automatic settlement of auction {auction_id} failed, retrying: {e}")
+            self.schedule(auction_id, datetime.utcnow() + timedelta(seconds=RETRY_SECONDS))
+
+    def _run(self):
+        while True:
+            self._pool.submit(self._settle_or_retry, self._next_due())
+
+
+settlement_scheduler = SettlementScheduler()
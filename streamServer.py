@@ -0,0 +1,69 @@
+"""
+Live auction streams, served apart from the API:
+
+    gunicorn -c gunicorn.streams.conf.py "streamServer:create_app()"
+
+Route /auctions/<id>/stream to this server. Under its gevent workers a
+watcher holds a greenlet rather than a request thread, and each auction's
+pump still reads Mongo once per tick for every watcher in the process.
+backend.py serves the same blueprint for local development.
+"""
+import queue
+from flask import Blueprint, Flask, Response, jsonify, stream_with_context
+from flask_cors import CORS
+from auctionClock import auction_clock
+from auctionStream import StreamsFull, auction_stream, format_sse
+
+stream_bp = Blueprint('streams', __name__)
+
+
+# 📡 Live highest-bid, new-bid and countdown events for an auction
+@stream_bp.route("/auctions/<auction_id>/stream", methods=["GET"])
+def stream_auction(auction_id):
+    try:
+        if auction_clock.deadline(auction_id) is None:
+            return jsonify({"error": "Auction not found"}), 404
+    except ValueError:
+        return jsonify({"error": "Invalid auction end time"}), 500
+
+    try:
+        q = auction_stream.subscribe(auction_id)
+    except StreamsFull:
+        response = jsonify({"error": "Too many live viewers on this server, please retry shortly"})
+        response.headers["Retry-After"] = "5"
+        return response, 503
+
+    def generate():
+        try:
+            yield format_sse("snapshot", auction_stream.snapshot(auction_id))
+            while True:
+                try:
+                    event, data = q.get(timeout=15)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event, data)
+                if event == "closed":
+                    return
+        finally:
+            auction_stream.unsubscribe(auction_id, q)
+
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # Frees the slot even if the client leaves before the first event
+    response.call_on_close(lambda: auction_stream.unsubscribe(auction_id, q))
+    return response
+
+
+def create_app():
+    app = Flask(__name__)
+    app.register_blueprint(stream_bp, url_prefix='/')
+    CORS(app,
+         supports_credentials=True,
+         origins="*",
+         allow_headers=["Content-Type", "Authorization"],
+         methods=["GET", "OPTIONS"])
+    return app
@@ -0,0 +1,83 @@
+from datetime import datetime
+
+import pytest
+
+import settlement
+
+
+@pytest.fixture
+def auction(db):
+    """Lot p1 in auction A1: amy bid 100 then won with 200, bob was outbid at 150."""
+    db.users.insert_many([
+        {"username": "amy", "wallet_balance": 700},
+        {"username": "bob", "wallet_balance": 850},
+    ])
+    db.products.insert_one({"id": "p1", "auction_id": "A1", "highest_bid": 200, "highest_bidder": "amy"})
+    now = datetime.utcnow()
+    db.bids.insert_many([
+        {"product_id": "p1", "auction_id": "A1", "user_id": "amy", "amount": 100, "timestamp": now},
+        {"product_id": "p1", "auction_id": "A1", "user_id": "bob", "amount": 150, "timestamp": now},
+        {"product_id": "p1", "auction_id": "A1", "user_id": "amy", "amount": 200, "timestamp": now},
+    ])
+    return settlement.winning_bids(["p1"])
+
+
+def balances(db):
+    return {u["username"]: u["wallet_balance"] for u in db.users.find()}
+
+
+def test_refunds_everything_but_the_winning_bid(db, auction):
+    report = settlement.refund_losing_bids("A1", auction)
+
+    assert report == {"users": 2, "bids": 2, "amount": 250}
+    assert balances(db) == {"amy": 800, "bob": 1000}
+    refunds = {t["username"]: t for t in db.transactions.find({"type": "refund"})}
+    assert {u: (t["amount"], t["status"]) for u, t in refunds.items()} == {"amy": (100, "applied"), "bob": (150, "applied")}
+    statuses = sorted((b["user_id"], b["amount"], b.get("status")) for b in db.bids.find())
+    assert statuses == [("amy", 100, "refunded"), ("amy", 200, None), ("bob", 150, "refunded")]
+
+
+def test_rerun_credits_nothing(db, auction):
+    settlement.refund_losing_bids("A1", auction)
+
+    assert settlement.refund_losing_bids("A1", auction) == {"users": 0, "bids": 0, "amount": 0}
+    assert balances(db) == {"amy": 800, "bob": 1000}
+    assert db.transactions.count_documents({"type": "refund"}) == 2
+
+
+def test_no_refund_markers_are_left_on_users(db, auction):
+    settlement.refund_losing_bids("A1", auction)
+
+    assert all(not u.get("pending_refunds") for u in db.users.find())
+    assert all("refunded_auctions" not in u for u in db.users.find())
+
+
+def test_rerun_finishes_an_interrupted_refund_once(db, auction):
+    # The previous run recorded both refunds and credited bob, then stopped
+    now = datetime.utcnow()
+    db.transactions.insert_many([
+        {"ref": "refund:A1:amy", "username": "amy", "type": "refund", "amount": 100,
+         "timestamp": now, "status": "pending", "meta": {"auction_id": "A1", "bids": 1}},
+        {"ref": "refund:A1:bob", "username": "bob", "type": "refund", "amount": 150,
+         "timestamp": now, "status": "pending", "meta": {"auction_id": "A1", "bids": 1}},
+    ])
+    db.users.update_one(
+        {"username": "bob"},
+        {"$inc": {"wallet_balance": 150}, "$push": {"pending_refunds": "refund:A1:bob"}}
+    )
+
+    report = settlement.refund_losing_bids("A1", auction)
+
+    assert report == {"users": 1, "bids": 1, "amount": 100}
+    assert balances(db) == {"amy": 800, "bob": 1000}
+    assert {t["status"] for t in db.transactions.find({"type": "refund"})} == {"applied"}
+    assert all(not u.get("pending_refunds") for u in db.users.find())
+
+
+def test_missing_bidder_is_not_reported_as_credited(db, auction):
+    db.users.delete_one({"username": "bob"})
+
+    report = settlement.refund_losing_bids("A1", auction)
+
+    assert report == {"users": 1, "bids": 1, "amount": 100}
+    assert balances(db) == {"amy": 800}
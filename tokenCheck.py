@@ -1,5 +1,7 @@
 
 import os
+import time
+import hashlib
 import bcrypt
 import jwt
 from dotenv import load_dotenv
@@ -11,6 +13,34 @@ SECRET_KEY =os.getenv("SECRET_KEY")
 from functools import wraps
 from flask import request, jsonify
 import jwt
+from cache import TTLCache
+
+# Verified claims keyed by sha256 of the token, so repeat requests skip the
+# HMAC check. An entry never outlives the token's exp.
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = 300.0
+token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+
+def verify_token(token):
+    """Decoded claims of a valid token; raises jwt.InvalidTokenError otherwise."""
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    claims = token_cache.get(key)
+    if claims is not None:
+        if "exp" in claims and claims["exp"] <= time.time():
+            token_cache.pop(key)
+            raise jwt.ExpiredSignatureError("Signature has expired")
+        return dict(claims)
+
+    claims = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    ttl = TOKEN_CACHE_TTL
+    if "exp" in claims:
+        ttl = min(ttl, claims["exp"] - time.time())
+    if ttl > 0:
+        token_cache.set(key, claims, ttl)
+    # Handlers get their own copy so they can't alter the cached claims
+    return dict(claims)
+
 
 def token_required(f):
     @wraps(f)
@@ -34,7 +64,7 @@ def token_required(f):
             return jsonify({"error": "Token is missing!"}), 401
 
         try:
-            decoded_data = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+            decoded_data = verify_token(token)
             return f(decoded_data, *args, **kwargs)
         except jwt.ExpiredSignatureError:
             return jsonify({"error": "Token has expired!"}), 401
@@ -1,10 +1,20 @@
-from flask import Blueprint, request, jsonify,current_app as app
+from flask import Blueprint, request, jsonify, current_app as app
 from pymongo import MongoClient
 from datetime import datetime
 from pymongo.errors import PyMongoError
 from tokenCheck import token_required
 from db import DB_NAME,MONGO_URI,db
 from bson import ObjectId
+from bidEngine import debit_wallet, credit_wallet, claim_highest_bid, embedded_bid_push
+from orderBook import order_book
+from auditWriter import audit_writer
+from productResolver import product_resolver
+from auctionRegistrations import registration_index
+from auctionClock import auction_clock, deadline_iso, live_auctions_query, parse_deadline, seconds_left
+from pagination import InvalidCursor, keyset_page, page_args
+from auctionStream import auction_stream
+from auctionSnapshot import auction_snapshot
+from rateLimits import BID_IP_LIMIT, BID_LIMIT, bid_key, client_ip, limiter
 
 # client = MongoClient(MONGO_URI)
 # db = client[DB_NAME]
@@ -16,22 +26,55 @@ users=db["users"]
 admins=db["admins"]
 transactions=db["transactions"]
 
+USER_BID_FIELDS = {"product_id": 1, "product_name": 1, "auction_id": 1, "amount": 1, "status": 1}
+PRODUCT_BID_FIELDS = {"amount": 1, "user_id": 1, "status": 1}
+
+
+def paged_response(result, next_cursor):
+    """List body as before; the continuation token travels in X-Next-Cursor."""
+    response = jsonify(result)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response, 200
+
 
 
 
 # 1️⃣ Get all auctions (upcoming & live)
 @user_bp.route("/auctions", methods=["GET"])
 def list_auctions():
-    now = datetime.utcnow().isoformat()
-    data = auctions.find({"valid_until": {"$gt": now}})
-    return jsonify([{"id":a["id"],"name":a["name"],"valid_until":a["valid_until"]} for a in data]), 200
+    data = auctions.find(live_auctions_query(), {"id": 1, "name": 1, "valid_until": 1})
+    return jsonify([{"id":a["id"],"name":a["name"],"valid_until":deadline_iso(a["valid_until"])} for a in data]), 200
 
 # 2️⃣ Get products by auction
 @user_bp.route("/auctions/<auction_id>/products", methods=["GET"])
 def list_auction_products(auction_id):
-    prods = products.find({"auction_id": auction_id, "status":"unsold"})
+    prods = products.find({"auction_id": auction_id, "status":"unsold"}, {"id": 1, "name": 1})
     return jsonify([{"id":p["id"],"name":p["name"]} for p in prods]), 200
 
+# 🧾 Everything an agent needs to describe an auction, in one call
+@user_bp.route("/auctions/<auction_id>/snapshot", methods=["GET"])
+def get_auction_snapshot(auction_id):
+    try:
+        snapshot = auction_snapshot(auction_id)
+        if snapshot is None:
+            return jsonify({"error": "Auction not found"}), 404
+
+        deadline = snapshot["deadline"]
+        return jsonify({
+            "auction": snapshot["auction"],
+            "time_remaining_seconds": seconds_left(deadline) if deadline else None,
+            "products": snapshot["products"],
+            "generated_at": snapshot["generated_at"]
+        }), 200
+
+    except PyMongoError as e:
+        app.logger.error(f"Database error in get_auction_snapshot: {str(e)}")
+        return jsonify({"error": "Failed to build auction snapshot due to database error"}), 500
+    except Exception as e:
+        app.logger.error(f"Unexpected error in get_auction_snapshot: {str(e)}")
+        return jsonify({"error": "An unexpected error occurred"}), 500
+
 
 
 
@@ -67,30 +110,23 @@ def register_auction(decoded_token):
 
     try:
         # 1️⃣ Check if auction exists
-        auction = auctions.find_one({"id": aid})
-        if not auction:
-            return jsonify({"error": "Auction not found"}), 404
-
-        # 2️⃣ Check if auction is still valid (not expired)
         try:
-            auction_end = datetime.fromisoformat(auction.get("valid_until"))
-        except Exception:
+            auction_end = auction_clock.deadline(aid)
+        except ValueError:
             return jsonify({"error": "Invalid auction end date format"}), 500
 
-        if datetime.utcnow() >= auction_end:
+        if auction_end is None:
+            return jsonify({"error": "Auction not found"}), 404
+
+        # 2️⃣ Check if auction is still valid (not expired)
+        if auction_clock.has_ended(aid):
             return jsonify({"error": "Auction has already ended"}), 400
 
-        # 3️⃣ Check if user already registered
-        if user_id in auction.get("registrations", []):
+        # 3️⃣ Register; the unique (auction_id, user_id) index rejects repeats
+        if not registration_index.register(aid, user_id):
             return jsonify({"message": "User already registered for this auction"}), 200
 
-        # 4️⃣ Add user to auction's registrations
-        auctions.update_one(
-            {"id": aid},
-            {"$addToSet": {"registrations": user_id}}
-        )
-
-        # 5️⃣ Add auction_id to user's auctions list
+        # 4️⃣ Add auction_id to user's auctions list
         users.update_one(
             {"_id": ObjectId(user_id)},
             {"$addToSet": {"auctions": aid}}
@@ -103,6 +139,8 @@ def register_auction(decoded_token):
         return jsonify({"error": "Failed to register for auction"}), 500
 
 @user_bp.route("/bid", methods=["POST"])
+@limiter.limit(BID_LIMIT, key_func=bid_key)
+@limiter.limit(BID_IP_LIMIT, key_func=client_ip)
 def place_bid():
     try:
         data = request.get_json()
@@ -120,7 +158,7 @@ def place_bid():
             return jsonify({"success": False, "message": "Missing required fields"}), 400
 
         # 1️⃣ Validate User
-        user = users.find_one({"username": username})
+        user = users.find_one({"username": username}, {"_id": 1, "wallet_balance": 1})
         if not user:
             return jsonify({"success": False, "message": "User not found"}), 404
 
@@ -128,18 +166,7 @@ def place_bid():
             return jsonify({"success": False, "message": "Insufficient wallet balance"}), 400
 
         # 2️⃣ Resolve Product
-        try:
-            prod_id_int = int(product_key)
-        except (ValueError, TypeError):
-            prod_id_int = None
-
-        product = products.find_one({
-            "$or": [
-                {"id": product_key},
-                {"id": prod_id_int},
-                {"name": product_key}
-            ]
-        })
+        product = product_resolver.resolve(product_key)
         if not product:
             return jsonify({"success": False, "message": "Product not found"}), 404
 
@@ -151,41 +178,60 @@ def place_bid():
             return jsonify({"success": False, "message": "Product is not part of an auction"}), 400
 
         # 3️⃣ Validate Auction
-        auction = auctions.find_one({"id": auction_id})
-        if not auction:
-            return jsonify({"success": False, "message": "Auction not found"}), 404
-
-        # 🔒 Check auction is still active
         try:
-            auction_end = datetime.fromisoformat(auction["valid_until"])
-        except Exception:
+            auction_end = auction_clock.deadline(auction_id)
+        except ValueError:
             return jsonify({"success": False, "message": "Invalid auction end time"}), 500
 
-        if now >= auction_end:
+        if auction_end is None:
+            return jsonify({"success": False, "message": "Auction not found"}), 404
+
+        # 🔒 Check auction is still active
+        if auction_clock.has_ended(auction_id, now):
             products.update_one({"id": product["id"]}, {"$set": {"status": "sold"}})
+            product_resolver.invalidate()
             return jsonify({"success": False, "message": "Auction has ended"}), 400
 
-        user_id_str = str(user.get("_id"))
-        registrations = [str(r) for r in auction.get("registrations", [])]
-
-        if user_id_str not in registrations:
+        if not registration_index.is_registered(auction_id, str(user.get("_id"))):
             return jsonify({"success": False, "message": "User not registered for this auction"}), 403
 
-        # 4️⃣ Check Highest Bid
-        embedded_bids = product.get("bids", [])
-        max_bid = max([b.get("amount", 0) for b in embedded_bids], default=0)
-
-        if bid_amount <= max_bid:
-            return jsonify({
-                "success": False,
-                "message": f"Bid must be higher than current max of ₹{max_bid}"
-            }), 400
-
-        # 5️⃣ Deduct wallet balance
-        users.update_one({"username": username}, {"$inc": {"wallet_balance": -bid_amount}})
-
-        # 6️⃣ Record the bid
-        bid_entry = {
+        # 4️⃣ Serialize bids on this lot and pre-check against the in-memory book
+        with order_book.lock(product["id"]):
+            max_bid = order_book.highest(product["id"])
+            if bid_amount <= max_bid:
+                return jsonify({
+                    "success": False,
+                    "message": f"Bid must be higher than current max of ₹{max_bid}"
+                }), 400
+
+            # 5️⃣ Deduct wallet balance (conditional, so concurrent bids can't overdraw)
+            if not debit_wallet(username, bid_amount):
+                return jsonify({"success": False, "message": "Insufficient wallet balance"}), 400
+
+            # 6️⃣ Atomically claim the highest bid; refund if another worker got there first
+            claimed = claim_highest_bid(product, username, bid_amount, auction_id)
+            if not claimed:
+                credit_wallet(username, bid_amount)
+                order_book.invalidate(product["id"])
+                latest = products.find_one(
+                    {"_id": product["_id"]}, {"highest_bid": 1, "status": 1, "closed_auction_id": 1}
+                ) or {}
+                if latest.get("closed_auction_id") == auction_id:
+                    return jsonify({"success": False, "message": "Auction has ended"}), 400
+                if latest.get("status") == "sold":
+                    return jsonify({"success": False, "message": "Product already sold"}), 400
+                return jsonify({
+                    "success": False,
+                    "message": f"Bid must be higher than current max of ₹{latest.get('highest_bid', max_bid)}"
+                }), 400
+
+            embedded_bid = {"amount": bid_amount, "timestamp": now, "user_id": username}
+            order_book.record(product["id"], embedded_bid)
+
+        auction_stream.bid_accepted(auction_id, product, bid_amount, username, now)
+
+        # 7️⃣ Persist the bid history behind the response
+        audit_writer.submit(bids, {
             "product_id": product.get("id"),
             "product_name": product.get("name"),
             "auction_id": auction_id,
@@ -193,11 +239,11 @@ def place_bid():
             "timestamp": now,
             "status": "success",
             "user_id": username
-        }
-        bids.insert_one(bid_entry)
+        })
+        audit_writer.submit_update(products, *embedded_bid_push(product["_id"], embedded_bid))
 
-        # 7️⃣ Log transaction
-        transactions.insert_one({
+        # 8️⃣ Log transaction
+        audit_writer.submit(transactions, {
             "username": username,
             "type": "bid",
             "amount": bid_amount,
@@ -208,18 +254,6 @@ def place_bid():
             }
         })
 
-        # 8️⃣ Add to embedded product bids
-        products.update_one(
-            {"_id": product["_id"]},
-            {"$push": {
-                "bids": {
-                    "amount": bid_amount,
-                    "timestamp": now,
-                    "user_id": username
-                }
-            }}
-        )
-
         return jsonify({"success": True, "message": "Bid placed successfully"}), 201
 
     except Exception as e:
@@ -234,9 +268,14 @@ def get_user_bids(decoded_token):
         if not username:
             return jsonify({"error": "Invalid token: missing username"}), 401
 
+        try:
+            limit, after = page_args(request.args)
+        except InvalidCursor as e:
+            return jsonify({"error": str(e)}), 400
+
         try:
             bid_query = {"user_id": username}
-            bid_list = bids.find(bid_query).sort("timestamp", -1)
+            bid_list, next_cursor = keyset_page(bids, bid_query, USER_BID_FIELDS, limit, after)
 
             result = []
             for b in bid_list:
@@ -250,8 +289,10 @@ def get_user_bids(decoded_token):
                     "status": b.get("status", "success")
                 })
 
-            return jsonify(result), 200
+            return paged_response(result, next_cursor)
 
+        except InvalidCursor as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             app.logger.error(f"Database error fetching user bids: {str(e)}")
             return jsonify({"error": "Failed to fetch user bids due to database error"}), 500
@@ -268,20 +309,12 @@ def get_all_bids():
             return jsonify({"error": "Missing product_key in query."}), 400
 
         try:
-            product_id = int(product_key)
-        except ValueError:
-            product_id = None
-
-        query = {
-            "$or": [
-                {"id": str(product_key)},
-                {"id": product_id},
-                {"name": product_key}
-            ]
-        }
+            limit, after = page_args(request.args)
+        except InvalidCursor as e:
+            return jsonify({"error": str(e)}), 400
 
         try:
-            product = products.find_one(query)
+            product = product_resolver.resolve(product_key)
             if not product:
                 return jsonify({"error": "Product not found"}), 404
 
@@ -293,7 +326,7 @@ def get_all_bids():
             }
 
             try:
-                bid_list = bids.find(bid_query).sort("timestamp", -1)
+                bid_list, next_cursor = keyset_page(bids, bid_query, PRODUCT_BID_FIELDS, limit, after)
                 result = []
                 for b in bid_list:
                     result.append({
@@ -302,7 +335,9 @@ def get_all_bids():
                         "timestamp": b.get("timestamp").isoformat() if b.get("timestamp") else None,
                         "status": b.get("status", "success")
                     })
-                return jsonify(result), 200
+                return paged_response(result, next_cursor)
+            except InvalidCursor as e:
+                return jsonify({"error": str(e)}), 400
             except PyMongoError as e:
                 app.logger.error(f"Database error fetching bids: {str(e)}")
                 return jsonify({"error": "Failed to fetch bids due to database error"}), 500
@@ -323,25 +358,11 @@ def get_highest_bid():
             return jsonify({"error": "Missing product_key in query."}), 400
 
         try:
-            product_id = int(product_key)
-        except ValueError:
-            product_id = None
-
-        query = {
-            "$or": [
-                {"id": str(product_key)},
-                {"id": product_id},
-                {"name": product_key}
-            ]
-        }
-
-        try:
-            product = products.find_one(query)
+            product = product_resolver.resolve(product_key)
             if not product:
                 return jsonify({"error": "Product not found"}), 404
 
-            embedded_bids = product.get("bids", [])
-            max_bid = max([b.get("amount", 0) for b in embedded_bids], default=0)
+            max_bid = order_book.highest(product["id"])
 
             return jsonify({
                 "product": product["name"],
@@ -362,38 +383,22 @@ def get_time_left():
         product_key = request.args.get("product_key")
         if not product_key:
             return jsonify({"error": "Missing product_key in query."}), 400
-        
-        try:
-            product_id = int(product_key)
-        except ValueError:
-            product_id = None
-
-        query = {
-            "$or": [
-                {"id": str(product_key)},
-                {"id": product_id},
-                {"name": product_key}
-            ]
-        }
 
         try:
-            product = products.find_one(query)
+            product = product_resolver.resolve(product_key)
             if not product:
                 return jsonify({"error": "Product not found"}), 404
             
-            # Fetch the parent auction
-            auction = auctions.find_one({"id": product.get("auction_id")})
-            if not auction or "valid_until" not in auction:
-                return jsonify({"error": "Auction end time not set"}), 400
+            # Deadline of the parent auction, from the in-memory clock
             try:
-                auction_end = datetime.fromisoformat(auction["valid_until"])
+                auction_end = auction_clock.deadline(product.get("auction_id"))
             except ValueError as e:
                 return jsonify({"error": f"Invalid auction end time: {e}"}), 400
+            if auction_end is None:
+                return jsonify({"error": "Auction end time not set"}), 400
+
+            time_left = seconds_left(auction_end)
 
-            now = datetime.utcnow()
-            time_left = (auction_end - now).total_seconds()
-            time_left = max(int(time_left), 0)
-            
             return jsonify({
                 "product": product["name"],
                 "time_remaining_seconds": time_left
@@ -407,6 +412,96 @@ def get_time_left():
         return jsonify({"error": "An unexpected error occurred"}), 500
 
 
+MAX_BATCH_PRODUCT_KEYS = 100
+
+
+# 📦 Highest bid, bid count and time left for many products in one call
+@user_bp.route("/products/status", methods=["GET", "POST"])
+def get_products_status():
+    try:
+        if request.method == "POST":
+            product_keys = (request.get_json(silent=True) or {}).get("product_keys")
+        else:
+            raw = request.args.get("product_keys")
+            product_keys = [k.strip() for k in raw.split(",") if k.strip()] if raw else None
+
+        if not product_keys or not isinstance(product_keys, list):
+            return jsonify({"error": "product_keys must be a non-empty list"}), 400
+        if len(product_keys) > MAX_BATCH_PRODUCT_KEYS:
+            return jsonify({"error": f"At most {MAX_BATCH_PRODUCT_KEYS} product_keys per call"}), 400
+
+        keys = [str(k) for k in product_keys]
+        int_keys = []
+        for k in keys:
+            try:
+                int_keys.append(int(k))
+            except ValueError:
+                pass
+
+        try:
+            # 1️⃣ One $in query for every product
+            found = list(products.find(
+                {"$or": [{"id": {"$in": keys + int_keys}}, {"name": {"$in": keys}}]},
+                {"_id": 0, "id": 1, "name": 1, "auction_id": 1, "status": 1, "highest_bid": 1, "bid_count": 1, "bid_count_pending": 1}
+            ))
+            by_id = {str(p["id"]): p for p in found}
+            by_name = {p["name"]: p for p in found}
+
+            # Products that predate the denormalized fields
+            legacy = [
+                p["id"] for p in found
+                if "highest_bid" not in p or "bid_count" not in p or p.get("bid_count_pending")
+            ]
+            if legacy:
+                for row in bids.aggregate([
+                    {"$match": {"product_id": {"$in": legacy}}},
+                    {"$group": {"_id": "$product_id", "highest": {"$max": "$amount"}, "count": {"$sum": 1}}}
+                ]):
+                    p = by_id.get(str(row["_id"]))
+                    if p:
+                        p.setdefault("highest_bid", row["highest"])
+                        if "bid_count" not in p or p.pop("bid_count_pending", False):
+                            p["bid_count"] = row["count"]
+
+            # 2️⃣ One query for every parent auction
+            auction_ids = list({p["auction_id"] for p in found if p.get("auction_id")})
+            deadlines = {}
+            for a in auctions.find({"id": {"$in": auction_ids}}, {"id": 1, "valid_until": 1}):
+                try:
+                    deadlines[a["id"]] = parse_deadline(a.get("valid_until"))
+                except ValueError:
+                    deadlines[a["id"]] = None
+
+        except PyMongoError as e:
+            app.logger.error(f"Database error in get_products_status: {str(e)}")
+            return jsonify({"error": "Failed to fetch product status due to database error"}), 500
+
+        now = datetime.utcnow()
+        result, not_found = [], []
+        for key in keys:
+            p = by_id.get(key) or by_name.get(key)
+            if not p:
+                not_found.append(key)
+                continue
+            deadline = deadlines.get(p.get("auction_id"))
+            result.append({
+                "product_key": key,
+                "product_id": p.get("id"),
+                "product": p.get("name"),
+                "auction_id": p.get("auction_id"),
+                "status": p.get("status"),
+                "highest_bid": p.get("highest_bid") or 0,
+                "bid_count": p.get("bid_count") or 0,
+                "time_remaining_seconds": seconds_left(deadline, now) if deadline else None
+            })
+
+        return jsonify({"products": result, "not_found": not_found}), 200
+
+    except Exception as e:
+        app.logger.error(f"Unexpected error in get_products_status: {str(e)}")
+        return jsonify({"error": "An unexpected error occurred"}), 500
+
+
 @user_bp.route("/user-bids/auction/<auction_id>", methods=["GET"])
 @token_required
 def get_user_bids_for_auction(decoded_token, auction_id):
@@ -5,6 +5,11 @@ from bson.objectid import ObjectId
 from pymongo.errors import PyMongoError
 from tokenCheck import token_required
 from db import DB_NAME,MONGO_URI
+from bidEngine import recompute_highest_bid
+from orderBook import order_book
+from auditWriter import audit_writer
+from auctionClock import auction_clock
+from pagination import InvalidCursor, keyset_page, page_args
 
 client = MongoClient(MONGO_URI)
 db = client[DB_NAME]
@@ -60,7 +65,7 @@ def wallet_topup(decoded_token):
     users.update_one({"_id": ObjectId(user_id)}, {"$inc": {"wallet_balance": amount}})
 
     # Add transaction
-    transactions.insert_one({
+    audit_writer.submit(transactions, {
         "username": username,
         "type": "topup",
         "amount": amount,
@@ -81,12 +86,15 @@ def rollback_bid():
     if not bid_id or not username:
         return jsonify({"error": "Missing bid_id or username"}), 400
 
+    # Make sure bids accepted by this worker have been written
+    audit_writer.flush()
+
     bid = bids.find_one({"_id": ObjectId(bid_id)})
     if not bid:
         return jsonify({"error": "Bid not found"}), 404
 
     # Check product expiry
-    product = products.find_one({"id": bid["product_id"]})
+    product = products.find_one({"id": bid["product_id"]}, {"bids": 0})
     if not product:
         return jsonify({"error": "Product not found"}), 404
 
@@ -94,14 +102,13 @@ def rollback_bid():
         return jsonify({"error": "Cannot rollback bid. Product already sold."}), 400
 
     # New: enforce auction’s valid_until instead
-    auction = auctions.find_one({"id": product.get("auction_id")})
-    if not auction or "valid_until" not in auction:
-        return jsonify({"error": "Auction timing not found"}), 400
     try:
-        auction_end = datetime.fromisoformat(auction["valid_until"])
+        auction_end = auction_clock.deadline(product.get("auction_id"))
     except ValueError:
         return jsonify({"error": "Invalid auction end time format"}), 400
-    if datetime.utcnow() >= auction_end:
+    if auction_end is None:
+        return jsonify({"error": "Auction timing not found"}), 400
+    if auction_clock.has_ended(product.get("auction_id")):
         return jsonify({"error": "Cannot rollback bid. Auction has ended."}), 400
 
     amount = bid["amount"]
@@ -112,14 +119,12 @@ def rollback_bid():
     # Remove bid from bids collection
     bids.delete_one({"_id": ObjectId(bid_id)})
 
-    # Remove from embedded product bids
-    products.update_one(
-        {"id": bid["product_id"]},
-        {"$pull": {"bids": {"amount": amount, "user_id": username}}}
-    )
+    # Rebuild the embedded top bids and denormalized highest bid
+    recompute_highest_bid(bid["product_id"])
+    order_book.invalidate(bid["product_id"])
 
     # Log the rollback
-    transactions.insert_one({
+    audit_writer.submit(transactions, {
         "username": username,
         "type": "refund",
         "amount": amount,
@@ -144,7 +149,14 @@ def get_wallet_transactions(decoded_token):
         return jsonify({"error": "Invalid token: missing user_id"}), 401
 
     try:
-        logs = list(transactions.find({"username": username}).sort("timestamp", -1))
+        limit, after = page_args(request.args)
+        logs, next_cursor = keyset_page(
+            transactions,
+            {"username": username},
+            {"username": 1, "type": 1, "amount": 1, "meta": 1},
+            limit,
+            after
+        )
 
         for tx in logs:
             tx["_id"] = str(tx["_id"])
@@ -153,9 +165,13 @@ def get_wallet_transactions(decoded_token):
         return jsonify({
             "user_id": user_id,
             "count": len(logs),
-            "transactions": logs
+            "transactions": logs,
+            "next_cursor": next_cursor
         }), 200
 
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
+
     except PyMongoError as e:
         app.logger.error(f"Database error fetching transactions: {str(e)}")
         return jsonify({"error": "Failed to fetch transactions"}), 500